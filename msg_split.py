@@ -6,19 +6,37 @@ You should have received a copy of the GNU General Public License along with thi
 Author Stepan Bakshaev, 2024.
 Contact stepan.bakshaev@keemail.me
 """
-from argparse import ArgumentParser
+if __name__ == '__main__':
+    # the command line starts without html parsers, see msg_split_cli.
+    from msg_split_cli import main, parse_arguments
+    main(parse_arguments())
+    raise SystemExit
+
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from dataclasses import dataclass
-from itertools import chain
-from typing import Iterator
+from itertools import chain, pairwise
+from os import cpu_count
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, TextIO
 
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString, PageElement, Tag
 
-MAX_LEN = 4096
-
+from msg_split_auto import ENGINE_COSTS, choose_engine
+from msg_split_const import ENGINES, MAX_LEN, STRATEGIES
+from msg_split_errors import UnprocessedValue
+from msg_split_fast import PARSERS, FastEventStream, FastSoup, FastString, FastTag, SliceEventStream, light_events
+from msg_split_render import Rendered, RenderCache
+from msg_split_stats import SplitStats, timed_fragments, timed_pulls
+from msg_split_stream import EventStream, chunks_of, read_ahead
+from msg_split_text import breakable, text_breaks
 
-class UnprocessedValue(Exception):
-    pass
+# split_messages sends messages to a worker in batches of the total length.
+BATCH_LEN = 64 * 1024
+# ...or of the amount.
+BATCH_SIZE = 1024
 
 
 split_tags = frozenset("p b strong i ul ol div span".split(' ')) | {BeautifulSoup.ROOT_TAG_NAME}
@@ -31,60 +49,77 @@ class Environment:
     """
     consumed: int  # overall length of fragment
     max_len: int  # limit for length
+    length: Callable[[str], int]  # measure of length, see msg_split_render.LENGTHS
     forward: list[str]  # leading text chunks of fragment
     backward: list[str]  # closing tags, tail of text chunks of fragment
     first_child: list[bool]  # it is used for cut parent-first_child from fragment.
+    parents: list[Rendered]  # open split tags, they are reopened by drain.
+    render: RenderCache
     eventual_encoding: str  # BeautifulSoup
     formatter: str|None  # BeautifulSoup
+    stats: SplitStats|None = None
+    # render results by id of node, shared by walks of one document over several limits. See split_message_multi.
+    rendered: dict[int, tuple]|None = None
+    break_text: bool = False  # string which does not fit is cut at whitespace, see place_text.
+    source: str|None = None  # the message, atomic tags with offsets are sliced from it. See verbatim of split_message.
 
 
-def walk(source_node: PageElement, environment: Environment, first_child) -> Iterator[Tag]:
+def make_environment(soup: BeautifulSoup, max_len: int, length: Callable[[str], int] = len, stats: SplitStats|None = None, break_text=False) -> Environment:
+    eventual_encoding = 'utf-8'
+    formatter = soup.formatter_for_name(None)
+    return Environment(
+        consumed=0,
+        max_len=max_len,
+        length=length,
+        forward=[],
+        backward=[],
+        first_child=[],
+        parents=[],
+        render=RenderCache(eventual_encoding, formatter, length=length),
+        eventual_encoding=eventual_encoding,
+        formatter=formatter,
+        stats=stats,
+        break_text=break_text
+    )
+
+
+def join(forward: list[str], backward: list[str], environment: Environment) -> str:
+    if environment.stats is None:
+        return ''.join(chain(forward, reversed(backward)))
+    start = perf_counter()
+    fragment = ''.join(chain(forward, reversed(backward)))
+    environment.stats.join_time += perf_counter() - start
+    return fragment
+
+
+def place(source_node: PageElement, forward: str, backward: str, length: int, environment: Environment, first_child: bool) -> Iterator[str]:
     """
-    Simple and recursive to be understandable by junior developer... by all time complexity consts.
+    Put rendered node into fragment. Drain fragment if the node does not fit.
+    length is weight of forward and backward by environment.length.
     """
-    # Measure current budget of the node.
-    # The trick is in a case of atomic node take all content. Hence, nothing to inspect on deeper level.
-    forward = ''
-    backward = ''
-    # contents makes walk go deeper or not.
-    contents = ()
-    if isinstance(source_node, Tag):
-        if source_node.name not in split_tags:
-            forward = source_node.decode(formatter=environment.formatter)
-        else:
-            contents = source_node.contents
-            forward = source_node._format_tag(
-                environment.eventual_encoding, environment.formatter, opening=True
-            )
-            if not source_node.is_empty_element:
-                backward = source_node._format_tag(
-                    environment.eventual_encoding, environment.formatter, opening=False
-                )
-    else:
-        assert isinstance(source_node, NavigableString), f'Unhandled type {type(source_node)}.'
-        forward = source_node.output_ready(formatter=environment.formatter)
-
-    length = len(forward) + len(backward)
+    stats = environment.stats
+    if stats is not None:
+        stats.pieces += 1
+        # the document root is a parent too.
+        stats.max_depth = max(stats.max_depth, len(environment.parents) - 1)
 
     # Make sure there is a space to put the node. Otherwise, drain.
     if length + environment.consumed > environment.max_len:
         # First, calculate new consumption to figure out fitting into limit.
-        # backward stays the same.
-        consumed = sum(map(len, environment.backward))
-        # forward is rebuilt by source_node parents.
+        # backward stays the same, forward is rebuilt by source_node parents.
+        consumed = 0
         fresh_forward = []
-        for node in source_node.parents:
-            opening = node._format_tag(
-                environment.eventual_encoding, environment.formatter, opening=True
-            )
-            consumed += len(opening)
-            fresh_forward.append(opening)
-        fresh_forward = list(reversed(fresh_forward))
+        for rendered in environment.parents:
+            consumed += rendered.length
+            fresh_forward.append(rendered.opening)
 
         if length + consumed > environment.max_len:
+            # NavigableString does not know its position.
+            sourceline = getattr(source_node, 'sourceline', None)
+            sourcepos = getattr(source_node, 'sourcepos', None)
             raise UnprocessedValue(
-                f'{source_node.sourceline}:{source_node.sourcepos}: piece {forward[:38]!r}..{backward[:38]!r} and html around cannot fit max_len ({environment.max_len}).',
-                source_node.sourceline, source_node.sourcepos, forward+backward, environment.max_len
+                f'{sourceline}:{sourcepos}: piece {forward[:38]!r}..{backward[:38]!r} and html around cannot fit max_len ({environment.max_len}).',
+                sourceline, sourcepos, forward+backward, environment.max_len
             )
 
         forward_severed = len(environment.forward)
@@ -100,7 +135,10 @@ def walk(source_node: PageElement, environment: Environment, first_child) -> Ite
                 backward_severed -= 1
 
         # make fragment
-        yield ''.join(chain(environment.forward[:forward_severed], reversed(environment.backward[:backward_severed])))
+        yield join(environment.forward[:forward_severed], environment.backward[:backward_severed], environment)
+        if stats is not None:
+            stats.drains += 1
+            stats.reopened += sum(1 for rendered in environment.parents if rendered.opening)
 
         # update environment with fresh forward.
         environment.consumed = consumed
@@ -113,6 +151,91 @@ def walk(source_node: PageElement, environment: Environment, first_child) -> Ite
         environment.backward.append(backward)
     environment.first_child.append(first_child)
 
+
+def place_text(source_node: PageElement, forward: str, length: int, environment: Environment, first_child: bool) -> Iterator[str]:
+    """
+    place for a string when environment.break_text. The string which does not fit is cut at breaks: the fragment
+    takes the most of it, a cut is found by binary search over the break index. The rest goes to the next fragment.
+    """
+    # Time complexity is O(N) for the index plus O(log N) per fragment.
+    if length + environment.consumed <= environment.max_len:
+        yield from place(source_node, forward, '', length, environment, first_child)
+        return
+
+    breaks, weights = text_breaks(forward, environment.length)
+    end = len(breaks) - 1
+    start = 0
+    while True:
+        index = bisect_right(weights, weights[start] + environment.max_len - environment.consumed, start) - 1
+        if index == start:
+            # nothing fits this fragment, the next one has parents only.
+            room = environment.max_len - sum(rendered.length for rendered in environment.parents)
+            index = bisect_right(weights, weights[start] + room, start) - 1
+            if index == start:
+                # a word does not fit any fragment, place raises.
+                index = start + 1
+        yield from place(source_node, forward[breaks[start]:breaks[index]], '', weights[index] - weights[start], environment, first_child)
+        if index == end:
+            return
+        environment.first_child.pop()
+        first_child = False
+        start = index
+
+
+def render(source_node: PageElement, environment: Environment) -> tuple[str, str, int, list[PageElement], Rendered|None]:
+    """
+    Measure current budget of the node.
+    The trick is in a case of atomic node take all content. Hence, nothing to inspect on deeper level.
+    Split tag comes with cached rendering (and weight) to put on environment.parents.
+    """
+    if environment.rendered is not None:
+        result = environment.rendered.get(id(source_node))
+        if result is not None:
+            return result
+
+    forward = ''
+    backward = ''
+    length = 0
+    # contents makes walk go deeper or not.
+    contents = ()
+    rendered = None
+    if isinstance(source_node, (Tag, FastTag)):
+        if source_node.name not in split_tags:
+            if environment.source is not None and source_node.end != -1:
+                forward = environment.source[source_node.start:source_node.end]
+            else:
+                forward = source_node.decode(formatter=environment.formatter)
+            length = environment.length(forward)
+            if environment.stats is not None:
+                environment.stats.atomic += 1
+                environment.stats.atomic_size += length
+        else:
+            contents = source_node.contents
+            rendered = environment.render(source_node)
+            forward = rendered.opening
+            backward = rendered.closing
+            length = rendered.length
+    else:
+        assert isinstance(source_node, (NavigableString, FastString)), f'Unhandled type {type(source_node)}.'
+        forward = source_node.output_ready(formatter=environment.formatter)
+        length = environment.length(forward)
+    if environment.rendered is not None:
+        environment.rendered[id(source_node)] = forward, backward, length, contents, rendered
+    return forward, backward, length, contents, rendered
+
+
+def walk(source_node: PageElement, environment: Environment, first_child) -> Iterator[Tag]:
+    """
+    Simple and recursive to be understandable by junior developer... by all time complexity consts.
+    """
+    forward, backward, length, contents, rendered = render(source_node, environment)
+    if environment.break_text and breakable(source_node):
+        yield from place_text(source_node, forward, length, environment, first_child)
+    else:
+        yield from place(source_node, forward, backward, length, environment, first_child)
+    if rendered is not None:
+        environment.parents.append(rendered)
+
     # continue with children
     i_contents = iter(contents)
     first = next(i_contents, None)
@@ -125,56 +248,699 @@ def walk(source_node: PageElement, environment: Environment, first_child) -> Ite
     # move closing to forward. It is safe, because closing occupies consumption on beginning.
     if backward:
         environment.forward.append(environment.backward.pop())
+    environment.first_child.pop()
+    if rendered is not None:
+        environment.parents.pop()
+
+
+# Event of no node. walk_events yields None on it: a cooperative caller gets control back in between fragments.
+PAUSE_EVENT = object()
+
+
+def walk_events(events: Iterable[tuple[object, PageElement]], environment: Environment) -> Iterator[str]:
+    """
+    walk driven by pairs of Tag._event_stream() instead of recursion. The document root is entered implicitly.
+    Atomic node is placed on its end, when it is complete. Its inner events are skipped.
+    PAUSE_EVENT is yielded as None, nothing is placed.
+    """
+    root = Rendered('', '', 0)
+    environment.forward.append(root.opening)
+    environment.first_child.append(True)
+    environment.parents.append(root)
+
+    # walk passes True for the first child of every node.
+    first_child = True
+    atomic: Tag|None = None
+    atomic_first_child = False
+    for tag_event, source_node in events:
+        if atomic is not None:
+            if tag_event is Tag.END_ELEMENT_EVENT and source_node is atomic:
+                forward, _, length, _, _ = render(atomic, environment)
+                yield from place(atomic, forward, '', length, environment, atomic_first_child)
+                environment.first_child.pop()
+                atomic = None
+                first_child = False
+            continue
+
+        if tag_event is Tag.START_ELEMENT_EVENT:
+            if source_node.name not in split_tags:
+                atomic = source_node
+                atomic_first_child = first_child
+                continue
+            forward, backward, length, _, rendered = render(source_node, environment)
+            yield from place(source_node, forward, backward, length, environment, first_child)
+            environment.parents.append(rendered)
+            first_child = True
+
+        elif tag_event is Tag.END_ELEMENT_EVENT:
+            if environment.parents.pop().closing:
+                environment.forward.append(environment.backward.pop())
+            environment.first_child.pop()
+            first_child = False
+
+        elif tag_event is PAUSE_EVENT:
+            yield None
+
+        else:
+            # leaf: string or empty element.
+            forward, backward, length, _, _ = render(source_node, environment)
+            if environment.break_text and tag_event is Tag.STRING_ELEMENT_EVENT and breakable(source_node):
+                yield from place_text(source_node, forward, length, environment, first_child)
+            else:
+                yield from place(source_node, forward, backward, length, environment, first_child)
+            environment.first_child.pop()
+            first_child = False
+
+
+def tree_events(root: Tag) -> Iterator[tuple[object, PageElement]]:
+    """
+    Tag._event_stream() with explicit stack, which does not descend into atomic tags. walk_events renders them as a whole.
+    root itself is implicit as walk_events expects.
+    """
+    stack = [(root, iter(root.contents))]
+    while stack:
+        tag, contents = stack[-1]
+        node = next(contents, None)
+        if node is None:
+            stack.pop()
+            if stack:
+                yield Tag.END_ELEMENT_EVENT, tag
+        elif not isinstance(node, Tag):
+            yield Tag.STRING_ELEMENT_EVENT, node
+        elif node.is_empty_element:
+            yield Tag.EMPTY_ELEMENT_EVENT, node
+        else:
+            yield Tag.START_ELEMENT_EVENT, node
+            if node.name in split_tags:
+                stack.append((node, iter(node.contents)))
+            else:
+                yield Tag.END_ELEMENT_EVENT, node
+
+
+def finish(fragments: Iterable[str], environment: Environment) -> Iterator[str]:
+    """
+    Fragments of an engine, then the last one left in environment.
+    """
+    yield from fragments
+    if environment.forward:
+        yield join(environment.forward, environment.backward, environment)
+
+
+# Cut after closing of block tags is preferred by 'minimal' and 'balanced' strategies.
+block_tags = frozenset("p ul ol div".split(' '))
+
+
+@dataclass(slots=True)
+class Pieces:
+    """
+    Document as walk_events places it: opening and closing of split tag, atomic node, string, empty element are pieces.
+    Boundary i is in front of piece i, boundary len(texts) is the end.
+    Fragment from boundary a to b weighs openings[a] + sums[b] - sums[a] + closings[b].
+    """
+    texts: list[str]
+    elements: list[PageElement]
+    sums: list[int]  # prefix sums of weights of pieces
+    stacks: list[tuple|None]  # open split tags at boundary, linked list (Rendered, opening weight, closing weight, parent)
+    openings: list[int]  # weight of openings of open split tags at boundary
+    closings: list[int]  # weight of closings of them
+    candidates: list[int]  # boundaries fragment may end at. Not right after opening (parent-first_child chain).
+    blocks: list[bool]  # boundary is right after closing of block tag
+    depth: int = 0  # the most of open split tags
+
+
+def pieces_of(events: Iterable[tuple[object, PageElement]], environment: Environment) -> Pieces:
+    """
+    walk_events which keeps pieces instead of placing them.
+    """
+    pieces = Pieces([], [], [0], [None], [0], [0], [0], [False])
+    stack = None
+    depth = 0
+    openings = 0
+    closings = 0
+    atomic: Tag|None = None
+    for tag_event, source_node in events:
+        opened = False
+        block = False
+        if atomic is not None:
+            if tag_event is not Tag.END_ELEMENT_EVENT or source_node is not atomic:
+                continue
+            text, _, weight, _, _ = render(atomic, environment)
+            atomic = None
+
+        elif tag_event is Tag.START_ELEMENT_EVENT:
+            if source_node.name not in split_tags:
+                atomic = source_node
+                continue
+            rendered = environment.render(source_node)
+            closing = environment.length(rendered.closing)
+            text = rendered.opening
+            weight = rendered.length - closing
+            stack = (rendered, weight, closing, stack)
+            openings += weight
+            closings += closing
+            opened = True
+            depth += 1
+            if depth > pieces.depth:
+                pieces.depth = depth
+
+        elif tag_event is Tag.END_ELEMENT_EVENT:
+            rendered, opening, weight, stack = stack
+            text = rendered.closing
+            openings -= opening
+            closings -= weight
+            depth -= 1
+            block = source_node.name in block_tags
+
+        else:
+            text, _, weight, _, _ = render(source_node, environment)
+            if environment.break_text and tag_event is Tag.STRING_ELEMENT_EVENT and breakable(source_node):
+                # a word is a piece, greedy cuts are the ones of place_text.
+                breaks, weights = text_breaks(text, environment.length)
+                for index in range(1, len(breaks) - 1):
+                    pieces.texts.append(text[breaks[index-1]:breaks[index]])
+                    pieces.elements.append(source_node)
+                    pieces.sums.append(pieces.sums[-1] + weights[index] - weights[index-1])
+                    pieces.stacks.append(stack)
+                    pieces.openings.append(openings)
+                    pieces.closings.append(closings)
+                    pieces.blocks.append(False)
+                    pieces.candidates.append(len(pieces.texts))
+                if len(breaks) > 2:
+                    text = text[breaks[-2]:]
+                    weight = weights[-1] - weights[-2]
+
+        pieces.texts.append(text)
+        pieces.elements.append(source_node)
+        pieces.sums.append(pieces.sums[-1] + weight)
+        pieces.stacks.append(stack)
+        pieces.openings.append(openings)
+        pieces.closings.append(closings)
+        pieces.blocks.append(block)
+        if not opened:
+            pieces.candidates.append(len(pieces.texts))
+    return pieces
+
+
+def cuts_of(pieces: Pieces, max_len: int) -> list[int]:
+    """
+    Boundaries of the least amount of fragments, the fewest cuts not after block closing among them. 0 and the end included.
+    Fragment a..b fits if sums[a] - openings[a] >= sums[b] + closings[b] - max_len. The best of such a is found by
+    Fenwick tree of prefix minimum over ranks of sums[a] - openings[a]. O(N log N).
+    """
+    end = len(pieces.texts)
+    # nothing is left of the document, greedy gives one empty fragment.
+    if not end:
+        return [0, 0]
+    sums = pieces.sums
+    openings = pieces.openings
+    keys = sorted({sums[a] - openings[a] for a in pieces.candidates})
+    size = len(keys)
+    rank = {key: index for index, key in enumerate(keys)}
+    # (fragments, cuts not after block closing, boundary). Tree index of a key is size - rank: keys >= need are a prefix.
+    unreachable = (end + 2, 0, 0)
+    tree = [unreachable] * (size + 1)
+
+    def insert(boundary: int, cost: tuple[int, int, int]) -> None:
+        index = size - rank[sums[boundary] - openings[boundary]]
+        while index <= size:
+            if cost < tree[index]:
+                tree[index] = cost
+            index += index & -index
+
+    def best(need: int) -> tuple[int, int, int]:
+        index = size - bisect_left(keys, need)
+        found = unreachable
+        while index > 0:
+            if tree[index] < found:
+                found = tree[index]
+            index -= index & -index
+        return found
+
+    previous = [-1] * (end + 1)
+    reached = 0
+    insert(0, (0, 0, 0))
+    for boundary in pieces.candidates[1:]:
+        count, penalty, start = best(sums[boundary] + pieces.closings[boundary] - max_len)
+        if count > end:
+            continue
+        previous[boundary] = start
+        reached = boundary
+        insert(boundary, (count + 1, penalty + (not pieces.blocks[boundary]), boundary))
+
+    if previous[end] == -1:
+        raise unfit(pieces, reached, max_len)
+
+    cuts = [end]
+    while cuts[-1]:
+        cuts.append(previous[cuts[-1]])
+    cuts.reverse()
+    return cuts
+
+
+def greedy_cuts(pieces: Pieces, max_len: int) -> list[int]:
+    """
+    Boundaries of walk_events drains: a fragment takes pieces while they fit. 0 and the end included.
+    """
+    sums = pieces.sums
+    openings = pieces.openings
+    closings = pieces.closings
+    end = len(pieces.texts)
+    cuts = [0]
+    start = 0
+    last = 0
+    for boundary in pieces.candidates[1:]:
+        if openings[start] + sums[boundary] - sums[start] + closings[boundary] > max_len:
+            if last == start or openings[last] + sums[boundary] - sums[last] + closings[boundary] > max_len:
+                raise unfit(pieces, last, max_len)
+            cuts.append(last)
+            start = last
+        last = boundary
+    if cuts[-1] != end:
+        cuts.append(end)
+    return cuts
+
+
+def required_of(pieces: Pieces) -> tuple[int, int]:
+    """
+    The least max_len `pieces` can be cut by and the boundary in front of the piece which needs it.
+    A fragment does not end in between neighbour candidates and weight only grows with a fragment, so it is the
+    heaviest span of neighbour candidates: opening tags and the piece after them with all ancestors around.
+    """
+    sums = pieces.sums
+    openings = pieces.openings
+    closings = pieces.closings
+    required = 0
+    needs = 0
+    for start, end in pairwise(pieces.candidates):
+        weight = openings[start] + sums[end] - sums[start] + closings[end]
+        if weight > required:
+            required = weight
+            needs = end - 1
+    return required, needs
+
+
+def unfit(pieces: Pieces, boundary: int, max_len: int, required: int|None = None) -> UnprocessedValue:
+    source_node = pieces.elements[boundary]
+    piece = pieces.texts[boundary]
+    sourceline = getattr(source_node, 'sourceline', None)
+    sourcepos = getattr(source_node, 'sourcepos', None)
+    needs = '' if required is None else f', {required} is needed'
+    return UnprocessedValue(
+        f'{sourceline}:{sourcepos}: piece {piece[:38]!r} and html around cannot fit max_len ({max_len}){needs}.',
+        sourceline, sourcepos, piece, max_len, required
+    )
+
+
+def balanced_cuts(pieces: Pieces, max_len: int) -> list[int]:
+    """
+    The least amount of fragments with the smallest weight of the heaviest one. Binary search of the limit.
+    """
+    cuts = cuts_of(pieces, max_len)
+    count = len(cuts) - 1
+    # the heaviest fragment is not lighter than the average.
+    low = -(-pieces.sums[-1] // count)
+    high = max_len
+    while low < high:
+        middle = (low + high) // 2
+        try:
+            fits = cuts_of(pieces, middle)
+        except UnprocessedValue:
+            fits = None
+        if fits is not None and len(fits) - 1 == count:
+            high = middle
+            cuts = fits
+        else:
+            low = middle + 1
+    return cuts
+
+
+def walk_planned(events: Iterable[tuple[object, PageElement]], environment: Environment, strategy: str) -> Iterator[str]:
+    """
+    Fragments of walk_events cut by `strategy` instead of greedy drain. The whole document is kept as pieces.
+    """
+    pieces = pieces_of(events, environment)
+    yield from cut_pieces(pieces, environment, strategy)
+
+
+def cut_pieces(pieces: Pieces, environment: Environment, strategy: str) -> Iterator[str]:
+    """
+    Fragments of `pieces` by `strategy` for environment.max_len. Pieces do not depend on max_len.
+    All cuts are made before the first fragment, a failure is raised before it.
+    """
+    required, needs = required_of(pieces)
+    if required > environment.max_len:
+        raise unfit(pieces, needs, environment.max_len, required)
+    if strategy == 'balanced':
+        cuts = balanced_cuts(pieces, environment.max_len)
+    elif strategy == 'minimal':
+        cuts = cuts_of(pieces, environment.max_len)
+    else:
+        cuts = greedy_cuts(pieces, environment.max_len)
+
+    stats = environment.stats
+    if stats is not None:
+        stats.pieces += len(pieces.texts)
+        stats.drains += len(cuts) - 2
+        stats.max_depth = max(stats.max_depth, pieces.depth)
+
+    for start, end in pairwise(cuts):
+        prefix = []
+        node = pieces.stacks[start]
+        while node is not None:
+            prefix.append(node[0].opening)
+            node = node[3]
+        suffix = []
+        node = pieces.stacks[end]
+        while node is not None:
+            suffix.append(node[0].closing)
+            node = node[3]
+        if stats is None:
+            yield ''.join(chain(reversed(prefix), pieces.texts[start:end], suffix))
+            continue
+        stats.reopened += len(prefix)
+        join_start = perf_counter()
+        fragment = ''.join(chain(reversed(prefix), pieces.texts[start:end], suffix))
+        stats.join_time += perf_counter() - join_start
+        yield fragment
 
 
-def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
+def split_message(source: str|Iterable[str]|TextIO, max_len=MAX_LEN, engine='iterative', parser='bs4', length: Callable[[str], int] = len, strategy='greedy', stats: SplitStats|None = None, atomic=False, break_text=False, verbatim=False) -> Iterator[str]:
     """Splits the original message (`source`) into fragments of the specified length
-    (`max_len`)."""
-    # Time complexity is O(N). Space is O(N) with recursion cost. All is addition to html parsing.
+    (`max_len`).
+    `source` is either a whole string or chunks of it (iterable of str, text file object). Chunks are parsed
+    as they arrive.
+    `engine` is 'iterative' (explicit stack, any depth) or 'recursive' (walk, limited by recursion limit).
+    'auto' picks the engine for `parser` by a profile of the message, see msg_split_auto. The choice is in `stats`.
+    `parser` is 'bs4' (BeautifulSoup tree) or 'fast' (events of html.parser without the tree, iterative only).
+    `length` measures max_len: len (code points) or additive measure of msg_split_render.LENGTHS (UTF-16 code units, UTF-8 bytes).
+    `strategy` is 'greedy' (fill fragment until the next piece does not fit), 'minimal' (the least amount of fragments,
+    cuts after block closing are preferred) or 'balanced' (the least amount of fragments of the most even size),
+    the last two keep the whole document as pieces, iterative only.
+    `stats` is SplitStats to fill: time of parsing, walk, joins and counts of pieces, drains...
+    `atomic` is all or nothing: the whole document is cut before the first fragment and UnprocessedValue comes
+    before any of them, iterative only. 'minimal' and 'balanced' are atomic anyway.
+    `break_text` cuts a string which does not fit at whitespace instead of UnprocessedValue, a word longer than
+    max_len raises it still.
+    `verbatim` copies tags out of split_tags as they are in `source` instead of rendering them, iterative only.
+    Html is parsed as by parser 'fast' with offsets of tags, a tag is rendered if its source is not the tree
+    (something inside is closed implicitly). A stream is read whole."""
+    # Time complexity is O(N), O(N log N) for 'minimal', O(N log N log max_len) for 'balanced'.
+    # Space is O(N) with recursion cost. All is addition to html parsing.
     if max_len <= 1:
         raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+    if engine not in ENGINES:
+        raise ValueError(f'engine argument ({engine!r}) must be one of {sorted(ENGINES)}.', engine)
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+    if parser == 'fast' and engine == 'recursive':
+        raise ValueError('parser \'fast\' does not build a tree for engine \'recursive\'.', parser, engine)
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy argument ({strategy!r}) must be one of {sorted(STRATEGIES)}.', strategy)
+    if strategy != 'greedy' and engine == 'recursive':
+        raise ValueError(f'strategy {strategy!r} is not for engine \'recursive\'.', strategy, engine)
+    if atomic and engine == 'recursive':
+        raise ValueError('atomic is not for engine \'recursive\'.', engine)
+    if verbatim and engine == 'recursive':
+        raise ValueError('verbatim is not for engine \'recursive\'.', engine)
+
+    if engine == 'auto':
+        # the parser is of the caller, the engine is chosen for it.
+        candidates = [candidate for candidate in ENGINE_COSTS if candidate[1] == parser]
+        if strategy != 'greedy' or atomic or verbatim:
+            candidates = [candidate for candidate in candidates if candidate[0] != 'recursive']
+        choice = choose_engine(source, split_tags, candidates)
+        engine = choice.engine
+        if stats is not None:
+            stats.engine = choice.report()
+
+    if verbatim and not isinstance(source, str):
+        source = ''.join(chunks_of(source))
+    if not isinstance(source, str):
+        yield from split_stream(source, max_len, parser, length, strategy, stats, atomic, break_text)
+        return
 
     # shortcut
-    if len(source) <= max_len:
+    if length(source) <= max_len:
+        if stats is not None:
+            stats.fragments += 1
         yield source
         return
 
+    # plain text and flat markup are scanned without html.parser, events are the same.
+    events = None
+    if engine == 'iterative':
+        start = perf_counter()
+        events = light_events(source)
+        if stats is not None:
+            stats.parse_time += perf_counter() - start
+
+    if events is not None:
+        soup = FastSoup(split_tags)
+    elif verbatim:
+        stream = SliceEventStream(source, split_tags)
+        soup = stream.soup
+        events = parse_stream(stream)
+        if stats is not None:
+            events = timed_pulls(events, stats)
+    elif parser == 'fast':
+        yield from split_stream((source,), max_len, parser, length, strategy, stats, atomic, break_text)
+        return
+    else:
+        start = perf_counter()
+        try:
+            soup = BeautifulSoup(source, 'html.parser')
+        except Exception as e:
+            sourceline = None
+            sourcepos = None
+            raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+        if stats is not None:
+            stats.parse_time += perf_counter() - start
+        events = tree_events(soup)
+
+    environment = make_environment(soup, max_len, length, stats, break_text)
+    if verbatim:
+        environment.source = source
+    if engine == 'recursive':
+        fragments = walk(soup, environment, True)
+    elif strategy != 'greedy' or atomic:
+        fragments = walk_planned(events, environment, strategy)
+    else:
+        fragments = walk_events(events, environment)
+    fragments = finish(fragments, environment)
+    if stats is not None:
+        fragments = timed_fragments(fragments, stats)
+    yield from fragments
+
+
+def split_message_multi(source: str|Iterable[str]|TextIO, limits: Iterable[int], parser='bs4', length: Callable[[str], int] = len, strategy='greedy') -> dict[int, list[str]|UnprocessedValue]:
+    """Splits the original message (`source`) for every max_len of `limits`, as split_message does.
+    The message is parsed once and every node is rendered once, walks of limits share them.
+    Result is by limit: a list of fragments or UnprocessedValue of the limit. Other arguments are of split_message."""
+    # Time complexity is O(N) for parsing and rendering plus O(N) of a walk per limit. Space is O(N).
+    limits = sorted(set(limits))
+    if not limits:
+        return {}
+    if limits[0] <= 1:
+        raise ValueError(f'max_len argument ({limits[0]!r}) must be more then 0.', limits[0])
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy argument ({strategy!r}) must be one of {sorted(STRATEGIES)}.', strategy)
+
+    if not isinstance(source, str):
+        source = ''.join(chunks_of(source))
+
+    results: dict[int, list[str]|UnprocessedValue] = {}
+    # shortcut
+    weight = length(source)
+    for max_len in limits:
+        if weight <= max_len:
+            results[max_len] = [source]
+    limits = [max_len for max_len in limits if max_len not in results]
+    if not limits:
+        return results
+    # in order of limits.
+    results = dict.fromkeys(limits) | results
+
+    if parser == 'fast':
+        stream = FastEventStream((source,), split_tags)
+        soup = stream.soup
+        # the walk of every limit goes over the same events.
+        events = list(parse_stream(stream))
+    else:
+        try:
+            soup = BeautifulSoup(source, 'html.parser')
+        except Exception as e:
+            sourceline = None
+            sourcepos = None
+            raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+        events = list(tree_events(soup))
+
+    shared = make_environment(soup, limits[0], length)
+    shared.rendered = {}
+    pieces = pieces_of(events, shared) if strategy != 'greedy' else None
+    for max_len in limits:
+        environment = make_environment(soup, max_len, length)
+        # rendered once for all limits.
+        environment.render = shared.render
+        environment.rendered = shared.rendered
+        try:
+            if pieces is not None:
+                fragments = cut_pieces(pieces, environment, strategy)
+            else:
+                fragments = walk_events(events, environment)
+            results[max_len] = list(finish(fragments, environment))
+        except UnprocessedValue as e:
+            results[max_len] = e
+    return results
+
+
+def events_of(source: str, parser='bs4') -> tuple[BeautifulSoup|FastSoup, list[tuple[object, PageElement]]]:
+    """
+    Soup and events of the whole `source` as split_message gets them.
+    """
+    events = light_events(source)
+    if events is not None:
+        return FastSoup(split_tags), events
+    if parser == 'fast':
+        stream = FastEventStream((source,), split_tags)
+        return stream.soup, list(parse_stream(stream))
     try:
         soup = BeautifulSoup(source, 'html.parser')
     except Exception as e:
         sourceline = None
         sourcepos = None
         raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+    return soup, list(tree_events(soup))
+
+
+def min_feasible_max_len(source: str|Iterable[str]|TextIO, parser='bs4', length: Callable[[str], int] = len, break_text=False) -> int:
+    """The least max_len split_message can split the original message (`source`) by with any strategy.
+    It is the largest string (word with `break_text`), atomic subtree or empty element with ancestor tags reopened around.
+    Other arguments are of split_message."""
+    # Time complexity is O(N) in one pass over pieces. Space is O(N) of pieces.
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+    if not isinstance(source, str):
+        source = ''.join(chunks_of(source))
+    soup, events = events_of(source, parser)
+    required, _ = required_of(pieces_of(events, make_environment(soup, MAX_LEN, length, break_text=break_text)))
+    # shortcut takes the whole message.
+    return max(2, min(length(source), required))
+
+
+def check_splittable(source: str|Iterable[str]|TextIO, max_len=MAX_LEN, parser='bs4', length: Callable[[str], int] = len, break_text=False) -> None:
+    """Raises UnprocessedValue of split_message if the original message (`source`) cannot be split by `max_len`,
+    the least feasible max_len is the last of its args. Nothing is rendered to fragments."""
+    if max_len <= 1:
+        raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+    if not isinstance(source, str):
+        source = ''.join(chunks_of(source))
+    if length(source) <= max_len:
+        return
+    soup, events = events_of(source, parser)
+    pieces = pieces_of(events, make_environment(soup, max_len, length, break_text=break_text))
+    required, needs = required_of(pieces)
+    if required > max_len:
+        raise unfit(pieces, needs, max_len, required)
 
-    environment = Environment(
-        consumed=0,
-        max_len=max_len,
-        forward=[],
-        backward=[],
-        first_child=[],
-        eventual_encoding='utf-8',
-        formatter=soup.formatter_for_name(None)
-    )
-    for fragment in walk(soup, environment, True):
-        yield fragment
 
-    if environment.forward:
-        yield ''.join(chain(environment.forward, reversed(environment.backward)))
+def parse_stream(events: EventStream|FastEventStream) -> Iterator[tuple[object, PageElement]]:
+    # Parsing happens while pulling. Errors of the body of a consumer do not come here.
+    try:
+        yield from events
+    except Exception as e:
+        sourceline, sourcepos = events.getpos()
+        raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
 
 
-def main(opts):
-    with open(opts.source, 'rt') as stream:
-        source = stream.read()
+def split_stream(source: Iterable[str]|TextIO, max_len: int, parser='bs4', length: Callable[[str], int] = len, strategy='greedy', stats: SplitStats|None = None, atomic=False, break_text=False) -> Iterator[str]:
+    # Time complexity is O(N). Space is O(max_len + depth), the tree is released behind walk_events.
+    # Strategies other than greedy and atomic keep pieces of the whole document.
+    whole, chunks = read_ahead(chunks_of(source), max_len, length)
+    # shortcut
+    if whole is not None:
+        if stats is not None:
+            stats.fragments += 1
+        yield whole
+        return
 
-    for number, chunk in enumerate(split_message(source, max_len=opts.max_len), 1):
-        fragmen_length = len(chunk)
-        print(f'fragment #{number}: {fragmen_length} chars.')
-        print(chunk)
+    if parser == 'fast':
+        events = FastEventStream(chunks, split_tags)
+    else:
+        events = EventStream(chunks, split_tags)
+    environment = make_environment(events.soup, max_len, length, stats, break_text)
+    pairs = parse_stream(events)
+    if stats is not None:
+        pairs = timed_pulls(pairs, stats)
+    if strategy != 'greedy' or atomic:
+        fragments = walk_planned(pairs, environment, strategy)
+    else:
+        fragments = walk_events(pairs, environment)
+    fragments = finish(fragments, environment)
+    if stats is not None:
+        fragments = timed_fragments(fragments, stats)
+    yield from fragments
 
 
-if __name__ == '__main__':
-    arguments = ArgumentParser(description='Split html message by chunks in max-len size.')
-    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
-    arguments.add_argument('source', help='Path to source file.')
+def split_batch(batch: list[str|None], max_len: int, length: Callable[[str], int] = len) -> list[list[str]|UnprocessedValue|None]:
+    """
+    Worker side of split_messages. None is a message kept by the parent process, it is echoed back.
+    """
+    results = []
+    for source in batch:
+        if source is None:
+            results.append(None)
+            continue
+        try:
+            results.append(list(split_message(source, max_len, length=length)))
+        except UnprocessedValue as e:
+            results.append(e)
+    return results
+
+
+def split_messages(sources: Iterable[str], max_len=MAX_LEN, workers: int|None = None, batch_len=BATCH_LEN, length: Callable[[str], int] = len) -> Iterator[list[str]|UnprocessedValue]:
+    """Splits many messages (`sources`) on a process pool of `workers`.
+    Results are in order of `sources`: a list of fragments or UnprocessedValue of the message.
+    `length` goes to workers, it must be picklable (a function of a module)."""
+    if max_len <= 1:
+        raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
 
-    main(arguments.parse_args())
+    workers = workers or cpu_count() or 1
+    # Batches in flight. Keep the pool busy, but do not read all sources ahead.
+    in_flight: deque[tuple[list[str], Future|None]] = deque()
+
+    def results(batch: list[str], future: Future|None) -> Iterator[list[str]|UnprocessedValue]:
+        outcome = future.result() if future is not None else [None] * len(batch)
+        for source, result in zip(batch, outcome):
+            # shortcut happens here, it never crosses process boundary.
+            yield [source] if result is None else result
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        to_worker = []
+        batch_size = 0
+        for source in chain(sources, (None,)):
+            if source is not None:
+                batch.append(source)
+                if length(source) <= max_len:
+                    to_worker.append(None)
+                else:
+                    to_worker.append(source)
+                    batch_size += len(source)
+                if batch_size < batch_len and len(batch) < BATCH_SIZE:
+                    continue
+
+            if batch:
+                future = None
+                if batch_size:
+                    future = pool.submit(split_batch, to_worker, max_len, length)
+                in_flight.append((batch, future))
+                batch = []
+                to_worker = []
+                batch_size = 0
+
+            while len(in_flight) > 2 * workers or (source is None and in_flight):
+                yield from results(*in_flight.popleft())
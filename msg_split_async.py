@@ -0,0 +1,197 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import asyncio
+from argparse import ArgumentParser
+from concurrent.futures import Executor, ProcessPoolExecutor
+from threading import Event, Semaphore
+from typing import AsyncIterator, Callable, Iterable, Iterator, TextIO
+
+from msg_split import (
+    ENGINES, MAX_LEN, PAUSE_EVENT, STRATEGIES, finish, make_environment, parse_stream, split_message, split_tags,
+    walk_events
+)
+from msg_split_fast import PARSERS, FastEventStream, FastSoup, light_events
+from msg_split_render import LENGTHS
+from msg_split_stream import EventStream, chunks_of
+
+# Fragments made by the executor and not taken by the consumer yet.
+QUEUE_LEN = 16
+# A message shorter than this is split on the event loop itself, an executor costs more than the work.
+SLICE_LEN = 16 * 1024
+# The event loop gets control back every this many events.
+SLICE_EVENTS = 256
+# A message is parsed by this much in between events.
+SLICE_CHUNK = 4096
+
+# End of fragments in the queue.
+DONE = object()
+
+
+def paused(events: Iterable[tuple[object, object]], every: int) -> Iterator[tuple[object, object]]:
+    for number, pair in enumerate(events, 1):
+        yield pair
+        if number % every == 0:
+            yield PAUSE_EVENT, None
+
+
+def sliced_fragments(source: str, max_len: int, parser='bs4', length: Callable[[str], int] = len, every=SLICE_EVENTS) -> Iterator[str|None]:
+    """
+    Fragments of split_message (greedy, iterative) and None every `every` events. Html is parsed in between events.
+    """
+    # shortcut
+    if length(source) <= max_len:
+        yield source
+        return
+
+    events = light_events(source)
+    if events is not None:
+        soup = FastSoup(split_tags)
+    else:
+        chunks = (source[start:start+SLICE_CHUNK] for start in range(0, len(source), SLICE_CHUNK))
+        if parser == 'fast':
+            stream = FastEventStream(chunks, split_tags)
+        else:
+            stream = EventStream(chunks, split_tags)
+        soup = stream.soup
+        events = parse_stream(stream)
+    environment = make_environment(soup, max_len, length)
+    yield from finish(walk_events(paused(events, every), environment), environment)
+
+
+def split_list(source: str, max_len: int, engine: str, parser: str, length: Callable[[str], int], strategy: str, atomic: bool) -> list[str]:
+    """
+    Worker side of asplit_message on a process pool.
+    """
+    return list(split_message(source, max_len, engine, parser, length, strategy, atomic=atomic))
+
+
+async def asplit_message(
+        source: str|Iterable[str]|TextIO, max_len=MAX_LEN, engine='iterative', parser='bs4',
+        length: Callable[[str], int] = len, strategy='greedy', atomic=False, executor: Executor|None = None,
+        queue_len=QUEUE_LEN, slice_len=SLICE_LEN, slice_events=SLICE_EVENTS) -> AsyncIterator[str]:
+    """Splits the original message (`source`) as split_message does without blocking the event loop: `async for`.
+    Parse and walk run in `executor`, the default executor of the loop if None. The message is parsed by chunks in
+    between fragments. Fragments come out as they are made,
+    at most `queue_len` of them wait for the consumer, the walk waits for room. Leaving `async for` or cancellation
+    stops the walk before its next fragment.
+    ProcessPoolExecutor splits the whole message at once, `length` must be picklable, fragments come out after.
+    A string shorter than `slice_len` is split on the loop itself, the loop gets control every `slice_events` events
+    (greedy, iterative, not atomic only). Other arguments are of split_message."""
+    if max_len <= 1:
+        raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+    if engine not in ENGINES:
+        raise ValueError(f'engine argument ({engine!r}) must be one of {sorted(ENGINES)}.', engine)
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy argument ({strategy!r}) must be one of {sorted(STRATEGIES)}.', strategy)
+    if queue_len <= 0:
+        raise ValueError(f'queue_len argument ({queue_len!r}) must be more then 0.', queue_len)
+    if slice_events <= 0:
+        raise ValueError(f'slice_events argument ({slice_events!r}) must be more then 0.', slice_events)
+
+    loop = asyncio.get_running_loop()
+    if isinstance(source, str) and len(source) < slice_len and engine == 'iterative' and strategy == 'greedy' and not atomic:
+        fragments = sliced_fragments(source, max_len, parser, length, slice_events)
+        try:
+            for fragment in fragments:
+                if fragment is None:
+                    await asyncio.sleep(0)
+                else:
+                    yield fragment
+        finally:
+            fragments.close()
+        return
+
+    if isinstance(executor, ProcessPoolExecutor):
+        if not isinstance(source, str):
+            source = await loop.run_in_executor(None, ''.join, chunks_of(source))
+        for fragment in await loop.run_in_executor(executor, split_list, source, max_len, engine, parser, length, strategy, atomic):
+            yield fragment
+        return
+
+    queue = asyncio.Queue()
+    # room in the queue, the walk takes it before a fragment is made.
+    room = Semaphore(queue_len)
+    stop = Event()
+
+    def post(item):
+        # the consumer may leave and the loop may be closed before the walk sees stop.
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            stop.set()
+
+    def until_stop(chunks: Iterable[str]) -> Iterator[str]:
+        # the end of the source for the parser once the consumer leaves.
+        for chunk in chunks:
+            if stop.is_set():
+                return
+            yield chunk
+
+    def produce():
+        # a whole string is parsed before the first fragment, chunks are parsed in between fragments
+        # and stop is seen in between chunks.
+        chunks = source
+        if not isinstance(source, str):
+            chunks = until_stop(chunks_of(source))
+        elif length(source) > max_len:
+            chunks = until_stop(source[start:start+SLICE_CHUNK] for start in range(0, len(source), SLICE_CHUNK))
+        fragments = split_message(chunks, max_len, engine, parser, length, strategy, atomic=atomic)
+        try:
+            item = None
+            while item is not DONE:
+                room.acquire()
+                if stop.is_set():
+                    return
+                item = next(fragments, DONE)
+                post(item)
+        except Exception as e:
+            post(e)
+        finally:
+            fragments.close()
+
+    producer = loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item = await queue.get()
+            room.release()
+            if item is DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # the walk may wait for room.
+        room.release()
+        # the walk ends before its next fragment, no thread outlives the loop.
+        await producer
+
+
+async def collect(source: str, max_len: int, length: Callable[[str], int]) -> list[str]:
+    return [fragment async for fragment in asplit_message(source, max_len, length=length)]
+
+
+def main(opts):
+    length = LENGTHS[opts.length]
+    with open(opts.source, 'rt') as stream:
+        source = stream.read()
+    for number, chunk in enumerate(asyncio.run(collect(source, opts.max_len, length)), 1):
+        print(f'fragment #{number}: {length(chunk)} {opts.length}.')
+        print(chunk)
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Split html message by chunks in max-len size on asyncio event loop.')
+    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len.')
+    arguments.add_argument('source', help='Path to source file.')
+
+    main(arguments.parse_args())
@@ -0,0 +1,157 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import re
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Iterable
+
+from msg_split_fast import PARSERS, classify
+
+# Head of a message profiled, the rest is estimated by it.
+PROFILE_LEN = 64 * 1024
+PROFILE_TAG = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)[^<>]*?(/?)>')
+VOID_TAGS = frozenset('area base br col embed hr img input link meta source track wbr'.split(' '))
+# walk is a generator per level of nesting, a level costs a few frames.
+RECURSION_DEPTH = sys.getrecursionlimit() // 4
+
+# Engines of split_message which give the same fragments. msg_split_linearly is not here: it differs on atomic
+# tags inside atomic tags and raises its own UnprocessedValue.
+# Seconds per message, per 1000 characters, per 1000 tags, per 1000 characters of atomic tags.
+# Fitted by `python msg_split_bench.py --calibrate --size 2K 10K 50K 100K 400K --max-len 1024 --repeat 3`, the output
+# is pasted here. The fast parser does what bs4 does without the tree, it is the cheapest by every feature, so
+# split_message chooses the engine of the parser it is given. With bs4 the recursive engine is cheaper per tag and
+# the iterative one per character: markup-dense messages go to the first, text to the second.
+ENGINE_COSTS: dict[tuple[str, str], tuple[float, float, float, float]] = {
+    ('iterative', 'bs4'): (0.00014531, 0.000230615, 0.0091722, 0.000114772),
+    ('iterative', 'fast'): (0.000106145, 8.86045e-05, 0.00650739, 6.18614e-05),
+    ('recursive', 'bs4'): (0.000157499, 0.000256647, 0.00791369, 0.000112474),
+}
+
+
+@dataclass(slots=True)
+class Profile:
+    size: int  # characters
+    tags: int  # openings and closings, estimated by the head
+    depth: int  # of the head
+    atomic: int  # characters of tags not in split_tags, estimated by the head
+
+    def features(self) -> tuple[float, float, float, float]:
+        return 1.0, self.size / 1000, self.tags / 1000, self.atomic / 1000
+
+
+def profile_of(source: str, split_tags: frozenset[str]) -> Profile:
+    """
+    Shape of `source` by a scan of PROFILE_LEN head. Tags are matched by names, it is an estimate, not a parse.
+    """
+    # Time complexity is O(PROFILE_LEN).
+    head = source[:PROFILE_LEN]
+    tags = 0
+    depth = 0
+    atomic = 0
+    stack = []
+    atomic_start = -1
+    atomic_depth = 0
+    for match in PROFILE_TAG.finditer(head):
+        tags += 1
+        closing, name, empty = match.groups()
+        name = name.lower()
+        if closing:
+            # stray closing or misnested one is skipped.
+            if not stack or stack[-1] != name:
+                continue
+            stack.pop()
+            if atomic_start != -1 and len(stack) == atomic_depth:
+                atomic += match.end() - atomic_start
+                atomic_start = -1
+        elif not empty and name not in VOID_TAGS:
+            if atomic_start == -1 and name not in split_tags:
+                atomic_start = match.start()
+                atomic_depth = len(stack)
+            stack.append(name)
+            depth = max(depth, len(stack))
+    if atomic_start != -1:
+        atomic += len(head) - atomic_start
+
+    scale = len(source) / len(head) if head else 1.0
+    return Profile(size=len(source), tags=round(tags * scale), depth=depth, atomic=round(atomic * scale))
+
+
+@dataclass(slots=True)
+class EngineChoice:
+    """
+    Decision of engine='auto' of split_message and why it is made.
+    """
+    engine: str
+    parser: str
+    reason: str
+    profile: Profile|None = None
+    costs: dict[tuple[str, str], float]|None = None  # predicted seconds of candidates
+
+    def report(self) -> str:
+        return f'{self.engine}/{self.parser} ({self.reason})'
+
+
+def dominant(candidates: list[tuple[str, str]], costs: dict[tuple[str, str], tuple[float, ...]]) -> tuple[str, str]|None:
+    """
+    Candidate which costs the least by every feature, it is the cheapest for any profile.
+    """
+    for candidate in candidates:
+        if all(all(cost <= other for cost, other in zip(costs[candidate], costs[rival])) for rival in candidates):
+            return candidate
+    return None
+
+
+def choose_engine(
+        source: object, split_tags: frozenset[str], candidates: Iterable[tuple[str, str]] = tuple(ENGINE_COSTS),
+        costs: dict[tuple[str, str], tuple[float, float, float, float]] = ENGINE_COSTS) -> EngineChoice:
+    """(engine, parser) of `candidates` predicted to split `source` in the least time by `costs` (see ENGINE_COSTS).
+    A stream is not profiled, plain text and flat markup are scanned by the iterative engine without html.parser,
+    both go to the first iterative candidate. Html is not profiled either if a candidate is the cheapest by every
+    feature."""
+    candidates = list(candidates)
+    iterative = next(candidate for candidate in candidates if candidate[0] == 'iterative')
+    if not isinstance(source, str):
+        return EngineChoice(*iterative, 'stream, not profiled')
+    if classify(source) != 'html':
+        return EngineChoice(*iterative, 'light scan')
+    # the recursive engine may be out by depth, that is known by the profile.
+    candidate = dominant(candidates, costs)
+    if candidate is not None and candidate[0] != 'recursive':
+        return EngineChoice(*candidate, 'the cheapest by every feature')
+
+    profile = profile_of(source, split_tags)
+    if profile.depth >= RECURSION_DEPTH:
+        candidates = [candidate for candidate in candidates if candidate[0] != 'recursive']
+    features = profile.features()
+    predicted = {
+        candidate: sum(cost * feature for cost, feature in zip(costs[candidate], features))
+        for candidate in candidates
+    }
+    engine, parser = min(predicted, key=predicted.__getitem__)
+    return EngineChoice(engine, parser, f'predicted {predicted[engine, parser] * 1000:.3f} ms of {len(predicted)}', profile, predicted)
+
+
+def main(opts):
+    from msg_split import split_tags
+    with open(opts.source, 'rt') as stream:
+        source = stream.read()
+    choice = choose_engine(source, split_tags, [candidate for candidate in ENGINE_COSTS if candidate[1] == opts.parser])
+    print(choice.report())
+    print(choice.profile)
+    for (engine, parser), cost in (choice.costs or {}).items():
+        print(f'{engine}/{parser}: {cost * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Engine split_message picks for html message with engine auto.')
+    arguments.add_argument('--parser', choices=sorted(PARSERS), default='bs4')
+    arguments.add_argument('source', help='Path to source file.')
+
+    main(arguments.parse_args())
@@ -0,0 +1,199 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import json
+import sys
+from argparse import ArgumentParser
+from collections import deque
+from dataclasses import dataclass
+from glob import iglob
+from os import scandir
+from os.path import isdir
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, TextIO
+
+from msg_split import BATCH_LEN, MAX_LEN, UnprocessedValue, split_messages
+from msg_split_render import LENGTHS
+
+MB = 1024 * 1024
+# Output is written by this much, not by record.
+WRITE_BUFFER = 1024 * 1024
+# Progress line every this many messages.
+PROGRESS = 10000
+
+
+# Readers give (id, message) or (id, UnprocessedValue) of an input which is not a message, split_sources reports it
+# in errors as a message which cannot be split. args of UnprocessedValue are (message, line, pos) as of the parser.
+
+
+def read_file(name: str) -> str|UnprocessedValue:
+    # a file which cannot be read or is not UTF-8 is an error of its own, the run goes on.
+    try:
+        with open(name, 'rt', encoding='utf-8') as stream:
+            return stream.read()
+    except UnicodeDecodeError as e:
+        return UnprocessedValue(f'{name}: byte {e.start} is not UTF-8.', None, None)
+    except OSError as e:
+        return UnprocessedValue(f'{name}: {e.strerror or e}.', None, None)
+
+
+def read_directory(path: str) -> Iterator[tuple[str, str|UnprocessedValue]]:
+    # XXX: scandir order is of the file system, names are sorted to make runs comparable.
+    with scandir(path) as entries:
+        names = sorted(entry.path for entry in entries if entry.is_file())
+    for name in names:
+        yield name, read_file(name)
+
+
+def read_glob(pattern: str) -> Iterator[tuple[str, str|UnprocessedValue]]:
+    found = False
+    for name in sorted(iglob(pattern, recursive=True)):
+        found = True
+        if isdir(name):
+            continue
+        yield name, read_file(name)
+    # a path which does not exist is a glob of nothing.
+    if not found:
+        yield pattern, UnprocessedValue(f'{pattern}: no such file or directory.', None, None)
+
+
+def read_jsonl(stream: TextIO, id_field='id', source_field='source') -> Iterator[tuple[str, str|UnprocessedValue]]:
+    """Messages of JSONL `stream`: {"id": ..., "source": "<p>...</p>"} per line. Line number is id if there is no one.
+    A line which is not such a record is UnprocessedValue of the line number."""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, UnprocessedValue(f'{number}:{e.colno}: line is not JSON: {e.msg}.', number, e.colno)
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get(source_field), str):
+            yield number, UnprocessedValue(f'{number}:0: record has no {source_field!r} string.', number, 0)
+            continue
+        yield record.get(id_field, number), record[source_field]
+
+
+def read_sources(inputs: Iterable[str], stdin: TextIO|None = None) -> Iterator[tuple[str, str|UnprocessedValue]]:
+    """(id, message) of every input: `-` is JSONL on stdin, a directory is its files, anything else is a glob.
+    A glob of nothing, a file which cannot be read and a bad JSONL line are (id, UnprocessedValue)."""
+    for path in inputs:
+        if path == '-':
+            yield from read_jsonl(stdin or sys.stdin)
+        elif isdir(path):
+            yield from read_directory(path)
+        else:
+            yield from read_glob(path)
+
+
+@dataclass
+class Summary:
+    messages: int = 0
+    fragments: int = 0
+    errors: int = 0
+    size: int = 0  # characters of messages
+    seconds: float = 0.0
+
+    def report(self) -> str:
+        seconds = self.seconds or float('inf')
+        return (
+            f'messages: {self.messages}, fragments: {self.fragments}, errors: {self.errors}, '
+            f'{self.size / MB:.3f} MB in {self.seconds:.3f} s, '
+            f'{self.size / MB / seconds:.3f} MB/s, {self.messages / seconds:.0f} messages/s'
+        )
+
+
+def split_sources(
+        sources: Iterable[tuple[str, str|UnprocessedValue]], output: TextIO, errors: TextIO, max_len=MAX_LEN, workers: int|None = None,
+        length: Callable[[str], int] = len, text=False, progress: TextIO|None = None, progress_every=PROGRESS,
+        batch_len=BATCH_LEN) -> Summary:
+    """Splits (id, message) `sources` on `workers` processes. Every fragment is a JSONL record
+    {"id", "fragment", "length"} in `output`, "text" too if `text`. UnprocessedValue of a message is a record
+    {"id", "error", "line", "pos"} in `errors`, the run goes on. UnprocessedValue of an input (see read_sources)
+    is written when it is read, ahead of messages in flight. Returns totals of the run."""
+    summary = Summary()
+    # ids of messages in flight, split_messages keeps order of sources.
+    ids: deque[str] = deque()
+    start = perf_counter()
+
+    def failed(id_: str, error: UnprocessedValue) -> None:
+        summary.errors += 1
+        message, line, pos = (error.args + (None, None))[:3]
+        errors.write(json.dumps({'id': id_, 'error': message, 'line': line, 'pos': pos}, ensure_ascii=False) + '\n')
+
+    def messages() -> Iterator[str]:
+        for id_, source in sources:
+            if isinstance(source, UnprocessedValue):
+                summary.messages += 1
+                failed(id_, source)
+                continue
+            ids.append(id_)
+            summary.size += len(source)
+            yield source
+
+    lines = []
+    buffered = 0
+    for result in split_messages(messages(), max_len, workers=workers, batch_len=batch_len, length=length):
+        id_ = ids.popleft()
+        summary.messages += 1
+        if isinstance(result, UnprocessedValue):
+            failed(id_, result)
+        else:
+            for number, fragment in enumerate(result):
+                record = {'id': id_, 'fragment': number, 'length': length(fragment)}
+                if text:
+                    record['text'] = fragment
+                line = json.dumps(record, ensure_ascii=False) + '\n'
+                lines.append(line)
+                buffered += len(line)
+            summary.fragments += len(result)
+            if buffered >= WRITE_BUFFER:
+                output.write(''.join(lines))
+                lines.clear()
+                buffered = 0
+
+        if progress is not None and summary.messages % progress_every == 0:
+            summary.seconds = perf_counter() - start
+            print(summary.report(), file=progress, flush=True)
+
+    output.write(''.join(lines))
+    output.flush()
+    summary.seconds = perf_counter() - start
+    return summary
+
+
+def main(opts):
+    length = LENGTHS[opts.length]
+    # stdout of python is line buffered on terminal, output goes by WRITE_BUFFER anyway.
+    output = open(opts.output, 'wt', buffering=WRITE_BUFFER) if opts.output else open(sys.stdout.fileno(), 'wt', buffering=WRITE_BUFFER, closefd=False)
+    errors = open(opts.errors, 'wt') if opts.errors else sys.stderr
+    try:
+        summary = split_sources(
+            read_sources(opts.input), output, errors, opts.max_len, opts.workers, length, opts.text,
+            progress=None if opts.quiet else sys.stderr, progress_every=opts.progress,
+        )
+    finally:
+        output.close()
+        if errors is not sys.stderr:
+            errors.close()
+    print(summary.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Split many html messages by chunks in max-len size, JSONL out.')
+    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len.')
+    arguments.add_argument('--workers', type=int, default=None, help='Processes, all CPUs by default.')
+    arguments.add_argument('--output', help='Path to JSONL of fragments, stdout by default.')
+    arguments.add_argument('--errors', help='Path to JSONL of failed messages, stderr by default.')
+    arguments.add_argument('--text', action='store_true', help='Put text of fragments to output.')
+    arguments.add_argument('--progress', type=int, default=PROGRESS, help='Report every this many messages.')
+    arguments.add_argument('--quiet', action='store_true', help='No progress, summary only.')
+    arguments.add_argument('input', nargs='+', help='Directory, glob, or - for JSONL {"id", "source"} on stdin.')
+
+    main(arguments.parse_args())
@@ -0,0 +1,285 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import json
+import random
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from bs4 import BeautifulSoup
+
+import msg_split
+import msg_split_linearly
+from msg_split_auto import ENGINE_COSTS, profile_of
+
+MB = 1024 * 1024
+SIZE_UNITS = {'K': 1024, 'M': MB}
+
+WORDS = 'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore'.split()
+
+
+def words(rng: random.Random, amount: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(amount))
+
+
+# Shapes of messages. Every block is small enough to fit the smallest max_len of the benchmark.
+# Text node is not split, so plain text is broken by <br>.
+def flat_block(rng: random.Random) -> str:
+    return words(rng, 12) + '<br>\n'
+
+
+def paragraphs_block(rng: random.Random) -> str:
+    return f'<p>{words(rng, 8)} <b>{rng.choice(WORDS)}</b> {words(rng, 4)}</p>\n'
+
+
+def nested_block(rng: random.Random) -> str:
+    tags = [rng.choice(('div', 'span', 'ul', 'p', 'b', 'i', 'strong')) for _ in range(40)]
+    return ''.join(f'<{tag}>' for tag in tags) + words(rng, 6) + ''.join(f'</{tag}>' for tag in reversed(tags)) + '\n'
+
+
+def atomic_block(rng: random.Random) -> str:
+    return (
+        f'<a href="https://example.com/{rng.randrange(10**6)}"><code>{words(rng, 20)}</code>'
+        f'<table><tr><td>{words(rng, 10)}</td></tr></table></a>\n'
+    )
+
+
+def tables_block(rng: random.Random) -> str:
+    rows = ''.join(
+        f'<tr><td class="cell" id="r{rng.randrange(10**6)}">{words(rng, 3)} &amp; {rng.choice(WORDS)}</td>'
+        f'<td><a href="/item?id={rng.randrange(10**6)}&amp;page=2">{rng.choice(WORDS)}</a></td></tr>'
+        for _ in range(3)
+    )
+    return f'<table>{rows}</table>\n'
+
+
+def tags_block(rng: random.Random) -> str:
+    return ''.join(f'<span>{rng.choice(WORDS)}</span>' for _ in range(10)) + '<br>\n'
+
+
+def entities_block(rng: random.Random) -> str:
+    return ' '.join(rng.choice(('&amp;', '&lt;', '&gt;', '&quot;', '&#8212;', '&nbsp;', rng.choice(WORDS))) for _ in range(16)) + '<br>\n'
+
+
+SHAPES: dict[str, Callable[[random.Random], str]] = {
+    'flat': flat_block,
+    'paragraphs': paragraphs_block,
+    'nested': nested_block,
+    'atomic': atomic_block,
+    'entities': entities_block,
+    'tables': tables_block,
+    'tags': tags_block,
+}
+
+
+def generate(shape: str, size: int, seed=0) -> str:
+    """Message of `shape` at least `size` characters long."""
+    rng = random.Random(seed)
+    block = SHAPES[shape]
+    blocks = []
+    length = 0
+    while length < size:
+        piece = block(rng)
+        blocks.append(piece)
+        length += len(piece)
+    return ''.join(blocks)
+
+
+ENGINES: dict[str, Callable[..., Iterator[str]]] = {
+    'recursive': lambda source, max_len, parser: msg_split.split_message(source, max_len, engine='recursive', parser=parser),
+    'iterative': lambda source, max_len, parser: msg_split.split_message(source, max_len, parser=parser),
+    'linear': lambda source, max_len, parser: msg_split_linearly.split_message(source, max_len, parser=parser),
+    # the same automata with checks of its state on every step.
+    'linear-debug': lambda source, max_len, parser: msg_split_linearly.split_message(source, max_len, parser=parser, debug=True),
+}
+
+
+@dataclass
+class Result:
+    shape: str
+    size: int
+    max_len: int
+    engine: str
+    parser: str
+    seconds: float
+    fragments: int
+    mb_per_s: float
+    fragments_per_s: float
+    us_per_event: float  # parse events of the message, the whole run is divided by them
+    peak_memory: int|None  # bytes by tracemalloc
+    error: str|None
+
+
+def measure(engine: str, parser: str, source: str, max_len: int, repeat=1, memory=True) -> tuple[float, int, int|None, str|None]:
+    split_message = ENGINES[engine]
+    if parser == 'fast' and engine == 'recursive':
+        return 0.0, 0, None, 'recursive engine needs bs4 tree'
+    best = None
+    fragments = 0
+    try:
+        for _ in range(repeat):
+            start = perf_counter()
+            fragments = sum(1 for _ in split_message(source, max_len, parser))
+            seconds = perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+    except (msg_split.UnprocessedValue, msg_split_linearly.UnprocessedValue, RecursionError) as e:
+        return 0.0, 0, None, f'{type(e).__name__}: {str(e.args[0])[:80]}'
+
+    peak = None
+    if memory:
+        # tracemalloc slows everything down, it has own run.
+        tracemalloc.start()
+        try:
+            for _ in split_message(source, max_len, parser):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return best, fragments, peak, None
+
+
+def count_events(source: str) -> int:
+    return sum(1 for _ in BeautifulSoup(source, 'html.parser')._event_stream())
+
+
+def run(shapes: Iterable[str], sizes: Iterable[int], max_lens: Iterable[int], engines: Iterable[str], parsers=('bs4',), repeat=1, memory=True) -> Iterator[Result]:
+    max_lens = list(max_lens)
+    engines = list(engines)
+    parsers = list(parsers)
+    for shape in shapes:
+        for size in sizes:
+            source = generate(shape, size)
+            events = count_events(source)
+            for max_len in max_lens:
+                for engine in engines:
+                    for parser in parsers:
+                        seconds, fragments, peak, error = measure(engine, parser, source, max_len, repeat, memory)
+                        yield Result(
+                            shape=shape, size=len(source), max_len=max_len, engine=engine, parser=parser,
+                            seconds=seconds, fragments=fragments,
+                            mb_per_s=len(source) / MB / seconds if seconds else 0.0,
+                            fragments_per_s=fragments / seconds if seconds else 0.0,
+                            us_per_event=seconds * 1e6 / events if events else 0.0,
+                            peak_memory=peak, error=error,
+                        )
+
+
+def least_squares(rows: list[tuple[float, ...]], values: list[float]) -> list[float]:
+    """Coefficients x of the least sum of (row · x - value)², normal equations by Gauss elimination."""
+    size = len(rows[0])
+    matrix = [
+        [sum(row[i] * row[j] for row in rows) for j in range(size)] + [sum(row[i] * value for row, value in zip(rows, values))]
+        for i in range(size)
+    ]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda i: abs(matrix[i][column]))
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        if not matrix[column][column]:
+            continue
+        for i in range(size):
+            if i != column:
+                factor = matrix[i][column] / matrix[column][column]
+                matrix[i] = [a - factor * b for a, b in zip(matrix[i], matrix[column])]
+    return [matrix[i][size] / matrix[i][i] if matrix[i][i] else 0.0 for i in range(size)]
+
+
+def nonnegative_least_squares(rows: list[tuple[float, ...]], values: list[float]) -> list[float]:
+    """least_squares with coefficients >= 0. The solution is unconstrained on its positive coefficients,
+    every subset of them is tried: there are a few features."""
+    size = len(rows[0])
+    best = [0.0] * size
+    best_error = sum(value * value for value in values)
+    for mask in range(1, 1 << size):
+        columns = [i for i in range(size) if mask >> i & 1]
+        solution = least_squares([tuple(row[i] for i in columns) for row in rows], values)
+        if min(solution) < 0:
+            continue
+        coefficients = [0.0] * size
+        for i, coefficient in zip(columns, solution):
+            coefficients[i] = coefficient
+        error = sum((sum(c * f for c, f in zip(coefficients, row)) - value) ** 2 for row, value in zip(rows, values))
+        if error < best_error:
+            best = coefficients
+            best_error = error
+    return best
+
+
+def calibrate(sizes: Iterable[int], max_len=msg_split.MAX_LEN, repeat=3) -> dict[tuple[str, str], tuple[float, ...]]:
+    """ENGINE_COSTS of msg_split_auto fitted by time of candidates on every shape and size. A cost is not negative."""
+    rows = []
+    seconds: dict[tuple[str, str], list[float]] = {candidate: [] for candidate in ENGINE_COSTS}
+    for shape in SHAPES:
+        for size in sizes:
+            # <br> turns the light scan off, engines are chosen for html.
+            source = '<br>' + generate(shape, size)
+            rows.append(profile_of(source, msg_split.split_tags).features())
+            for engine, parser in ENGINE_COSTS:
+                best = None
+                for _ in range(repeat):
+                    start = perf_counter()
+                    for _ in msg_split.split_message(source, max_len, engine=engine, parser=parser):
+                        pass
+                    elapsed = perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                seconds[engine, parser].append(best)
+    # relative error: small messages count as much as large ones.
+    return {
+        candidate: tuple(nonnegative_least_squares([tuple(feature / value for feature in row) for row, value in zip(rows, values)], [1.0] * len(values)))
+        for candidate, values in seconds.items()
+    }
+
+
+def parse_size(value: str) -> int:
+    unit = SIZE_UNITS.get(value[-1:].upper())
+    if unit is None:
+        return int(value)
+    return int(float(value[:-1]) * unit)
+
+
+def main(opts):
+    if opts.calibrate:
+        print('ENGINE_COSTS: dict[tuple[str, str], tuple[float, float, float, float]] = {')
+        for candidate, costs in calibrate(opts.size, opts.max_len[0], opts.repeat).items():
+            print(f'    {candidate!r}: ({", ".join(f"{cost:.6g}" for cost in costs)}),')
+        print('}')
+        return
+
+    results = run(opts.shape, opts.size, opts.max_len, opts.engine, opts.parser, opts.repeat, not opts.no_memory)
+    if opts.json:
+        print(json.dumps([asdict(result) for result in results], indent=1))
+        return
+
+    print(f'{"shape":>10} {"size":>9} {"max_len":>7} {"engine":>12} {"parser":>6} {"MB/s":>8} {"fragments/s":>11} {"us/event":>8} {"peak KB":>9}')
+    for result in results:
+        if result.error:
+            print(f'{result.shape:>10} {result.size:>9} {result.max_len:>7} {result.engine:>12} {result.parser:>6} {result.error}')
+            continue
+        peak = '-' if result.peak_memory is None else f'{result.peak_memory // 1024}'
+        print(
+            f'{result.shape:>10} {result.size:>9} {result.max_len:>7} {result.engine:>12} {result.parser:>6} '
+            f'{result.mb_per_s:>8.3f} {result.fragments_per_s:>11.0f} {result.us_per_event:>8.3f} {peak:>9}',
+            flush=True
+        )
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Benchmark of split_message engines on synthetic messages.')
+    arguments.add_argument('--shape', nargs='+', choices=sorted(SHAPES), default=list(SHAPES))
+    arguments.add_argument('--size', nargs='+', type=parse_size, default=[parse_size(size) for size in '1K 10K 100K 1M'.split()], help='1K, 10M, ... up to 10M makes sense.')
+    arguments.add_argument('--max-len', nargs='+', type=int, default=[1024, msg_split.MAX_LEN, 16384])
+    arguments.add_argument('--engine', nargs='+', choices=sorted(ENGINES), default=list(ENGINES))
+    arguments.add_argument('--parser', nargs='+', choices=sorted(msg_split.PARSERS), default=['bs4'])
+    arguments.add_argument('--repeat', type=int, default=1, help='The best time of repeats.')
+    arguments.add_argument('--no-memory', action='store_true', help='Skip tracemalloc run.')
+    arguments.add_argument('--json', action='store_true')
+    arguments.add_argument('--calibrate', action='store_true', help='Print ENGINE_COSTS of msg_split_auto for --size and the first --max-len.')
+
+    main(arguments.parse_args())
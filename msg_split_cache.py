@@ -0,0 +1,89 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+from collections import OrderedDict
+from hashlib import blake2b
+from sys import getsizeof
+from threading import Lock
+from typing import Callable, Iterable, Iterator, TextIO
+
+from msg_split import MAX_LEN, split_message
+
+# Bounds of SplitCache. Whatever is hit first.
+CACHE_ENTRIES = 1024
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+def content_hash(source: str) -> bytes:
+    # surrogatepass: a str which came from anywhere is hashable.
+    return blake2b(source.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class SplitCache:
+    """
+    LRU memo of split_message. The same message with the same max_len and options is parsed once, hits cost
+    a hash of the content. Only str sources are kept, chunks and files go to split_message as is.
+    Bounded by amount of entries and by bytes of fragments. UnprocessedValue is not kept.
+    stats= is not a part of the key: a miss fills it as split_message does, a hit counts fragments only,
+    there is no parsing and no walk.
+    """
+    def __init__(self, entries=CACHE_ENTRIES, size=CACHE_BYTES, split: Callable[..., Iterator[str]] = split_message):
+        self.max_entries = entries
+        self.max_bytes = size
+        self.split = split
+        self.entries: OrderedDict[tuple, tuple[tuple[str, ...], int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __call__(self, source: str|Iterable[str]|TextIO, max_len=MAX_LEN, **options) -> Iterator[str]:
+        if not isinstance(source, str):
+            return self.split(source, max_len, **options)
+
+        stats = options.get('stats')
+        key = (content_hash(source), max_len, tuple(sorted((name, value) for name, value in options.items() if name != 'stats')))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if stats is not None:
+                    stats.fragments += len(entry[0])
+                return iter(entry[0])
+            self.misses += 1
+
+        fragments = tuple(self.split(source, max_len, **options))
+        size = sum(map(getsizeof, fragments))
+        if size > self.max_bytes:
+            return iter(fragments)
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (fragments, size)
+                self.bytes += size
+                while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.bytes -= evicted
+                    self.evictions += 1
+        return iter(fragments)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self.entries), 'bytes': self.bytes,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+        }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
@@ -0,0 +1,86 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import signal
+from argparse import ArgumentParser
+
+from msg_split_const import ENGINES, MAX_LEN, STRATEGIES
+from msg_split_render import LENGTHS
+from msg_split_serve import serve, split_remote
+from msg_split_stats import SplitStats
+
+# Command line of msg_split which starts without html parsers: they and the process pool take most of the start.
+# msg_split is imported when a message does not fit max_len. A message which fits and --connect do not import it.
+# `python msg_split.py` is this command line too, it comes here before its own imports.
+
+
+def main(opts):
+    length = LENGTHS[opts.length]
+    if opts.serve:
+        import msg_split
+        # kill of the daemon cleans up as ^C does.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        serve(opts.serve, msg_split.split_message)
+        return
+
+    stats = SplitStats() if opts.stats else None
+    with open(opts.source, 'rt') as stream:
+        if opts.connect:
+            fragments = split_remote(
+                opts.connect, stream.read(), opts.max_len, opts.length, opts.strategy, opts.engine, opts.atomic,
+                opts.break_text, opts.verbatim)
+        else:
+            # shortcut before imports. Text is not shorter in any of LENGTHS than in characters.
+            head = None
+            if opts.max_len > 1 and not (opts.mmap or opts.min_len or opts.stats):
+                head = stream.read(opts.max_len + 1)
+            if head is not None and len(head) <= opts.max_len and length(head) <= opts.max_len:
+                fragments = [head]
+            else:
+                import msg_split
+                stream.seek(0)
+                # mapped file is decoded by chunks, memory does not depend on size of the file.
+                if opts.mmap:
+                    from msg_split_stream import mapped_chunks
+                    stream = mapped_chunks(opts.source)
+                if opts.min_len:
+                    print(f'min max-len: {msg_split.min_feasible_max_len(stream, length=length, break_text=opts.break_text)} {opts.length}.')
+                    return
+                fragments = msg_split.split_message(stream, max_len=opts.max_len, engine=opts.engine, length=length, strategy=opts.strategy, stats=stats, atomic=opts.atomic, break_text=opts.break_text, verbatim=opts.verbatim)
+        for number, chunk in enumerate(fragments, 1):
+            fragmen_length = length(chunk)
+            print(f'fragment #{number}: {fragmen_length} {opts.length}.')
+            print(chunk)
+    if stats is not None:
+        print(stats.report())
+
+
+def parse_arguments():
+    arguments = ArgumentParser(description='Split html message by chunks in max-len size.')
+    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len.')
+    arguments.add_argument('--strategy', choices=sorted(STRATEGIES), default='greedy')
+    arguments.add_argument('--engine', choices=sorted(ENGINES), default='iterative')
+    arguments.add_argument('--stats', action='store_true', help='Print where time goes.')
+    arguments.add_argument('--mmap', action='store_true', help='Map source file instead of reading.')
+    arguments.add_argument('--atomic', action='store_true', help='Fail before the first fragment, not after some.')
+    arguments.add_argument('--break-text', action='store_true', help='Cut long text at whitespace.')
+    arguments.add_argument('--verbatim', action='store_true', help='Copy tags out of split tags from source as they are.')
+    arguments.add_argument('--min-len', action='store_true', help='Print the least feasible max-len only.')
+    arguments.add_argument('--serve', metavar='SOCKET', help='Split messages of clients of Unix socket, warm.')
+    arguments.add_argument('--connect', metavar='SOCKET', help='Send source to --serve process of the socket.')
+    arguments.add_argument('source', nargs='?', help='Path to source file.')
+
+    opts = arguments.parse_args()
+    if opts.source is None and opts.serve is None:
+        arguments.error('the following arguments are required: source')
+    return opts
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,309 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import mmap
+import struct
+import sys
+from argparse import ArgumentParser
+from array import array
+from typing import Callable, Iterator
+
+from bs4 import BeautifulSoup
+
+from msg_split import (
+    MAX_LEN, STRATEGIES, Pieces, UnprocessedValue, balanced_cuts, cuts_of, greedy_cuts, make_environment, parse_stream,
+    pieces_of, split_tags, tree_events
+)
+from msg_split_fast import PARSERS, FastEventStream
+from msg_split_render import LENGTHS
+
+# Compiled message is msg_split.Pieces in arrays: a piece is a token, its text is a span of one UTF-8 buffer.
+# Engines read the arrays, nothing is parsed or rendered again.
+
+# kinds of tokens
+OPEN = 0  # opening of split tag
+CLOSE = 1  # closing of split tag
+LEAF = 2  # string, empty element, atomic subtree rendered as a whole
+
+# flags of tokens
+SPLITTABLE = 1  # split tag, it is reopened in the next fragment
+BLOCK = 2  # closing of block tag, 'minimal' strategy prefers to cut after it
+
+# Serialized table: header, int64 columns, byte columns, buffer. Native byte order, as array does it.
+MAGIC = b'MSGSPLT1' if sys.byteorder == 'little' else b'MSGSPTB1'
+HEADER = struct.Struct('=8s16sqq')  # magic, measure name, amount of tokens, size of buffer
+# columns of amount + 1 items: boundary i is in front of token i.
+BOUNDARY_COLUMNS = ('offsets', 'sums', 'openings', 'closings')
+# columns of amount items.
+TOKEN_COLUMNS = ('parents', 'pairs', 'depths')
+BYTE_COLUMNS = ('kinds', 'flags')
+
+MEASURES = {length: name for name, length in LENGTHS.items()}
+
+
+class Texts:
+    """
+    Sequence of token texts, decoded on access.
+    """
+    def __init__(self, compiled: 'CompiledMessage'):
+        self.compiled = compiled
+
+    def __len__(self) -> int:
+        return self.compiled.amount
+
+    def __getitem__(self, index: int) -> str:
+        return self.compiled.text(index, index + 1)
+
+
+class CompiledMessage:
+    """
+    Token table of a message. Columns are array or memoryview of a loaded (mapped) table:
+    offsets  - start of token in buffer, bytes. The last one is the end of buffer.
+    sums     - prefix sums of weights of tokens.
+    openings - weight of openings of split tags open at boundary.
+    closings - weight of their closings.
+    parents  - opening token of the innermost split tag open after token, -1 is none.
+    pairs    - closing token of opening and opening of closing, -1 for leaf.
+    depths   - amount of split tags open after token.
+    kinds    - OPEN, CLOSE, LEAF.
+    flags    - SPLITTABLE, BLOCK.
+    Weights are of `measure`, fragments are measured by it only.
+    It quacks like msg_split.Pieces for greedy_cuts, cuts_of and balanced_cuts.
+    """
+    def __init__(self, measure: str, buffer: bytes|memoryview, **columns):
+        self.measure = measure
+        self.buffer = buffer
+        for name in BOUNDARY_COLUMNS + TOKEN_COLUMNS + BYTE_COLUMNS:
+            setattr(self, name, columns[name])
+        self.amount = len(self.kinds)
+        self.texts = Texts(self)
+        # no source positions, error reports take texts.
+        self.elements = self.texts
+        self.mapped: mmap.mmap|None = None
+
+    def text(self, start: int, end: int) -> str:
+        """Text of tokens start..end, one decode."""
+        return str(self.buffer[self.offsets[start]:self.offsets[end]], 'utf-8')
+
+    @property
+    def candidates(self) -> list[int]:
+        # a fragment does not end right after opening.
+        kinds = self.kinds
+        return [0] + [boundary for boundary in range(1, self.amount + 1) if kinds[boundary - 1] != OPEN]
+
+    @property
+    def blocks(self) -> list[bool]:
+        flags = self.flags
+        return [False] + [bool(flags[index] & BLOCK) for index in range(self.amount)]
+
+    def to_bytes(self) -> bytes:
+        parts = [HEADER.pack(MAGIC, self.measure.encode(), self.amount, len(self.buffer))]
+        for name in BOUNDARY_COLUMNS + TOKEN_COLUMNS + BYTE_COLUMNS:
+            parts.append(bytes(getattr(self, name)))
+        parts.append(bytes(self.buffer))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes|memoryview|mmap.mmap) -> 'CompiledMessage':
+        """Table over `data` as is, columns are not copied."""
+        view = memoryview(data)
+        magic, measure, amount, size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'data is not compiled message of {sys.byteorder} endian machine.', magic)
+        columns = {}
+        offset = HEADER.size
+        for name in BOUNDARY_COLUMNS + TOKEN_COLUMNS + BYTE_COLUMNS:
+            if name in BYTE_COLUMNS:
+                columns[name] = view[offset:offset + amount]
+                offset += amount
+                continue
+            items = amount + 1 if name in BOUNDARY_COLUMNS else amount
+            columns[name] = view[offset:offset + 8 * items].cast('q')
+            offset += 8 * items
+        return cls(measure.rstrip(b'\0').decode(), view[offset:offset + size], **columns)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as stream:
+            stream.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledMessage':
+        """Mapped table of file `path`. Pages are shared by processes which load the same file."""
+        with open(path, 'rb') as stream:
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        compiled = cls.from_bytes(mapped)
+        compiled.mapped = mapped
+        return compiled
+
+
+def compile_message(source: str, length: Callable[[str], int] = len, parser='bs4') -> CompiledMessage:
+    """Parses and renders the original message (`source`) once to a token table of `length` measure (one of
+    msg_split_render.LENGTHS). split_compiled splits it for any max_len without BeautifulSoup."""
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+    if length not in MEASURES:
+        raise ValueError(f'length argument ({length!r}) must be one of msg_split_render.LENGTHS.', length)
+
+    if parser == 'fast':
+        stream = FastEventStream((source,), split_tags)
+        soup = stream.soup
+        events = parse_stream(stream)
+    else:
+        try:
+            soup = BeautifulSoup(source, 'html.parser')
+        except Exception as e:
+            sourceline = None
+            sourcepos = None
+            raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+        events = tree_events(soup)
+    # max_len is not used by pieces.
+    return compile_pieces(pieces_of(events, make_environment(soup, MAX_LEN, length)), length)
+
+
+def compile_pieces(pieces: Pieces, length: Callable[[str], int] = len) -> CompiledMessage:
+    """Token table of `pieces` weighed by `length`."""
+    amount = len(pieces.texts)
+    offsets = array('q', [0])
+    kinds = array('B')
+    flags = array('B')
+    parents = array('q')
+    pairs = array('q', [-1]) * amount
+    depths = array('q')
+    chunks = []
+    # opening token of a stack node.
+    opened: dict[int, int] = {}
+    stacks = pieces.stacks
+    offset = 0
+    depth = 0
+    for index, text in enumerate(pieces.texts):
+        chunk = text.encode('utf-8')
+        chunks.append(chunk)
+        offset += len(chunk)
+        offsets.append(offset)
+
+        before = stacks[index]
+        after = stacks[index + 1]
+        if after is before:
+            kinds.append(LEAF)
+            flags.append(0)
+        elif after is not None and after[3] is before:
+            kinds.append(OPEN)
+            flags.append(SPLITTABLE)
+            opened[id(after)] = index
+        else:
+            kinds.append(CLOSE)
+            flags.append(SPLITTABLE | (BLOCK if pieces.blocks[index + 1] else 0))
+            pair = opened.pop(id(before))
+            pairs[pair] = index
+            pairs[index] = pair
+        parents.append(-1 if after is None else opened[id(after)])
+        depth += 1 if kinds[-1] == OPEN else -1 if kinds[-1] == CLOSE else 0
+        depths.append(depth)
+
+    return CompiledMessage(
+        MEASURES[length], b''.join(chunks),
+        offsets=offsets, sums=array('q', pieces.sums), openings=array('q', pieces.openings),
+        closings=array('q', pieces.closings), parents=parents, pairs=pairs, depths=depths, kinds=kinds, flags=flags,
+    )
+
+
+def join_compiled(tables: list[CompiledMessage]) -> CompiledMessage:
+    """
+    Table of consecutive parts of a message. Every part but the last ends with no split tag open, as the top level
+    of the message does.
+    """
+    measure = tables[0].measure
+    columns = {name: array('B' if name in BYTE_COLUMNS else 'q') for name in BOUNDARY_COLUMNS + TOKEN_COLUMNS + BYTE_COLUMNS}
+    columns['offsets'].append(0)
+    columns['sums'].append(0)
+    columns['openings'].append(0)
+    columns['closings'].append(0)
+    buffers = []
+    tokens = 0
+    size = 0
+    weight = 0
+    for table in tables:
+        if table.measure != measure:
+            raise ValueError(f'tables are of different measures: {measure!r}, {table.measure!r}.', measure, table.measure)
+        # the first boundary of a part is the last one of the previous part.
+        columns['offsets'].extend(offset + size for offset in table.offsets[1:])
+        columns['sums'].extend(total + weight for total in table.sums[1:])
+        columns['openings'].extend(table.openings[1:])
+        columns['closings'].extend(table.closings[1:])
+        columns['parents'].extend(-1 if token == -1 else token + tokens for token in table.parents)
+        columns['pairs'].extend(-1 if token == -1 else token + tokens for token in table.pairs)
+        columns['depths'].extend(table.depths)
+        columns['kinds'].extend(table.kinds)
+        columns['flags'].extend(table.flags)
+        buffers.append(bytes(table.buffer))
+        tokens += table.amount
+        size += table.offsets[table.amount]
+        weight += table.sums[table.amount]
+    return CompiledMessage(measure, b''.join(buffers), **columns)
+
+
+def ancestors(compiled: CompiledMessage, boundary: int) -> list[int]:
+    """Opening tokens of split tags open at `boundary`, the outermost first."""
+    openings = []
+    token = compiled.parents[boundary - 1] if boundary else -1
+    while token != -1:
+        openings.append(token)
+        token = compiled.parents[token - 1] if token else -1
+    openings.reverse()
+    return openings
+
+
+def split_compiled(compiled: CompiledMessage, max_len=MAX_LEN, strategy='greedy') -> Iterator[str]:
+    """Splits compiled message into fragments of `max_len` in the measure of the table.
+    Fragments are the same as split_message of a message which does not fit max_len. `strategy` is of split_message."""
+    # Time complexity is O(N) of tokens for greedy, see cuts_of for others. No parsing, no rendering.
+    if max_len <= 1:
+        raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy argument ({strategy!r}) must be one of {sorted(STRATEGIES)}.', strategy)
+
+    if not compiled.amount:
+        return
+    if strategy == 'balanced':
+        cuts = balanced_cuts(compiled, max_len)
+    elif strategy == 'minimal':
+        cuts = cuts_of(compiled, max_len)
+    else:
+        cuts = greedy_cuts(compiled, max_len)
+
+    pairs = compiled.pairs
+    for start, end in zip(cuts, cuts[1:]):
+        prefix = ''.join(compiled.texts[token] for token in ancestors(compiled, start))
+        suffix = ''.join(compiled.texts[pairs[token]] for token in reversed(ancestors(compiled, end)))
+        yield prefix + compiled.text(start, end) + suffix
+
+
+def main(opts):
+    if opts.compile:
+        with open(opts.source, 'rt') as stream:
+            compiled = compile_message(stream.read(), LENGTHS[opts.length], opts.parser)
+        compiled.save(opts.compile)
+        print(f'{compiled.amount} tokens, {len(compiled.to_bytes())} bytes.')
+        return
+
+    compiled = CompiledMessage.load(opts.source)
+    for number, chunk in enumerate(split_compiled(compiled, max_len=opts.max_len, strategy=opts.strategy), 1):
+        print(f'fragment #{number}: {LENGTHS[compiled.measure](chunk)} {compiled.measure}.')
+        print(chunk)
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Compile html message to token table, split compiled message by chunks in max-len size.')
+    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len, compile time.')
+    arguments.add_argument('--parser', choices=sorted(PARSERS), default='bs4')
+    arguments.add_argument('--strategy', choices=sorted(STRATEGIES), default='greedy')
+    arguments.add_argument('--compile', metavar='TABLE', help='Compile html source to TABLE file.')
+    arguments.add_argument('source', help='Path to html source (--compile) or to compiled table.')
+
+    main(arguments.parse_args())
@@ -0,0 +1,14 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+
+# Options of msg_split without dependencies: the command line parses arguments without importing html parsers.
+
+MAX_LEN = 4096
+ENGINES = frozenset(('iterative', 'recursive', 'auto'))
+STRATEGIES = frozenset(('greedy', 'minimal', 'balanced'))
@@ -0,0 +1,534 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import re
+from collections import Counter, deque
+from itertools import chain
+from typing import Iterable, Iterator
+
+from bs4 import BeautifulSoup
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from bs4.element import NavigableString, PreformattedString, Tag
+from bs4.formatter import Formatter, HTMLFormatter
+
+# Splitting needs only a stream of events and rendering of atomic tags. The tree of BeautifulSoup is not built.
+# html.parser and BeautifulSoupHTMLParser are reused as is: entities, duplicate attributes, empty elements are
+# the same as bs4 backend gives. FastSoup mimics BeautifulSoup tree construction methods with the open-tag stack only.
+
+PARSERS = frozenset(('bs4', 'fast'))
+
+# OffsetSoup events which bs4 does not have: an end tag which closes nothing (element is None) and the end of a tag
+# closed implicitly, by the end tag of an ancestor or by the end of the source. The source has no end tag for it.
+STRAY_END_EVENT = object()
+IMPLICIT_END_EVENT = object()
+
+
+class FastTag:
+    """
+    Tag without tree. contents is kept only inside atomic tag, it is rendered as a whole.
+    start and end are offsets of the tag in the source, SliceSoup records them. -1 is unknown.
+    """
+    __slots__ = ('name', 'attrs', 'parent', 'contents', 'sourceline', 'sourcepos', 'can_be_empty_element', 'start', 'end')
+    prefix = None
+    hidden = False
+    # _format_tag looks at name, prefix, hidden, is_empty_element and attrs only. The rendering is the same by construction.
+    _format_tag = Tag._format_tag
+
+    def __init__(self, name, attrs, parent, sourceline, sourcepos, can_be_empty_element):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.contents = None
+        self.sourceline = sourceline
+        self.sourcepos = sourcepos
+        self.can_be_empty_element = can_be_empty_element
+        self.start = -1
+        self.end = -1
+
+    @property
+    def is_empty_element(self) -> bool:
+        return not self.contents and self.can_be_empty_element
+
+    # HTMLTreeBuilder.set_up_substitutions protocol.
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def get_attribute_list(self, key, default=None):
+        value = self.attrs.get(key, default)
+        if not isinstance(value, list):
+            value = [value]
+        return value
+
+    def __setitem__(self, key, value):
+        self.attrs[key] = value
+
+    def decode(self, eventual_encoding='utf-8', formatter: Formatter|str = 'minimal') -> str:
+        # Tag.decode without indentation, iterative.
+        if not isinstance(formatter, Formatter):
+            formatter = HTMLFormatter.REGISTRY[formatter]
+        pieces = [self._format_tag(eventual_encoding, formatter, opening=True)]
+        if self.is_empty_element:
+            return pieces[0]
+        stack = [(self, iter(self.contents or ()))]
+        while stack:
+            tag, contents = stack[-1]
+            node = next(contents, None)
+            if node is None:
+                stack.pop()
+                pieces.append(tag._format_tag(eventual_encoding, formatter, opening=False))
+            elif isinstance(node, FastString):
+                pieces.append(node.output_ready(formatter))
+            else:
+                pieces.append(node._format_tag(eventual_encoding, formatter, opening=True))
+                if not node.is_empty_element:
+                    stack.append((node, iter(node.contents or ())))
+        return ''.join(pieces)
+
+    def __repr__(self):
+        return f'<{self.name}>'
+
+
+class FastString:
+    """
+    String without tree. kind is NavigableString class bs4 would create, it defines prefix, suffix and formatting.
+    """
+    __slots__ = ('text', 'parent', 'kind')
+    name = None
+
+    def __init__(self, text, parent, kind):
+        self.text = text
+        self.parent = parent
+        self.kind = kind
+
+    def output_ready(self, formatter: Formatter|str|None = 'minimal') -> str:
+        # NavigableString.output_ready and PreformattedString.output_ready.
+        output = self.text
+        if formatter is not None and not issubclass(self.kind, PreformattedString):
+            if not isinstance(formatter, Formatter):
+                formatter = HTMLFormatter.REGISTRY[formatter]
+            if formatter.entity_substitution and not (self.parent is not None and self.parent.name in formatter.cdata_containing_tags):
+                output = formatter.entity_substitution(output)
+        return self.kind.PREFIX + output + self.kind.SUFFIX
+
+    def __repr__(self):
+        return repr(self.text)
+
+
+class FastSoup:
+    """
+    The part of BeautifulSoup which BeautifulSoupHTMLParser calls. Tree construction is reported as
+    Tag._event_stream() pairs of FastTag and FastString.
+    """
+    ROOT_TAG_NAME = BeautifulSoup.ROOT_TAG_NAME
+    ASCII_SPACES = BeautifulSoup.ASCII_SPACES
+
+    def __init__(self, split_tags: frozenset[str]):
+        self.split_tags = split_tags
+        self.builder = HTMLParserTreeBuilder()
+        self.contains_replacement_characters = False
+        self.events = deque()
+        self.current_data = []
+        self.root = FastTag(self.ROOT_TAG_NAME, {}, None, None, None, False)
+        self.tagStack = [self.root]
+        self.currentTag = self.root
+        self.open_tag_counter = Counter()
+        self.preserve_whitespace_tag_stack = []
+        self.string_container_stack = []
+        # amount of open atomic tags, their descendants are kept in contents.
+        self.atomic = 0
+
+    def formatter_for_name(self, name: str|None) -> Formatter:
+        return HTMLFormatter.REGISTRY[name]
+
+    def emit(self, tag_event, element: FastTag|FastString) -> None:
+        self.events.append((tag_event, element))
+
+    def adopt(self, node: FastTag|FastString) -> None:
+        if self.atomic:
+            parent = self.currentTag
+            if parent.contents is None:
+                parent.contents = []
+            parent.contents.append(node)
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs, sourceline=None, sourcepos=None, namespaces=None) -> FastTag:
+        self.endData()
+        builder = self.builder
+        if builder.cdata_list_attributes:
+            attrs = builder._replace_cdata_list_attribute_values(name, attrs)
+        tag = FastTag(name, attrs, self.currentTag, sourceline, sourcepos, builder.can_be_empty_element(name))
+        builder.set_up_substitutions(tag)
+        self.adopt(tag)
+        self.pushTag(tag)
+        return tag
+
+    def handle_endtag(self, name, nsprefix=None) -> None:
+        self.endData()
+        self._popToTag(name, nsprefix)
+
+    def handle_data(self, data: str) -> None:
+        self.current_data.append(data)
+
+    def pushTag(self, tag: FastTag) -> None:
+        self.tagStack.append(tag)
+        self.currentTag = tag
+        self.open_tag_counter[tag.name] += 1
+        if tag.name in self.builder.preserve_whitespace_tags:
+            self.preserve_whitespace_tag_stack.append(tag)
+        if tag.name in self.builder.string_containers:
+            self.string_container_stack.append(tag)
+        if self.atomic or tag.name not in self.split_tags:
+            self.atomic += 1
+        if not tag.can_be_empty_element:
+            self.emit(Tag.START_ELEMENT_EVENT, tag)
+
+    def popTag(self) -> FastTag:
+        tag = self.tagStack.pop()
+        self.open_tag_counter[tag.name] -= 1
+        if self.preserve_whitespace_tag_stack and tag is self.preserve_whitespace_tag_stack[-1]:
+            self.preserve_whitespace_tag_stack.pop()
+        if self.string_container_stack and tag is self.string_container_stack[-1]:
+            self.string_container_stack.pop()
+        if self.atomic:
+            self.atomic -= 1
+        self.currentTag = self.tagStack[-1]
+        if tag.is_empty_element:
+            self.emit(Tag.EMPTY_ELEMENT_EVENT, tag)
+        else:
+            assert not tag.can_be_empty_element, f'{tag.name} is started as empty element and has content.'
+            self.emit(Tag.END_ELEMENT_EVENT, tag)
+        return self.currentTag
+
+    def _popToTag(self, name, nsprefix=None) -> None:
+        # BeautifulSoup._popToTag
+        if name == self.ROOT_TAG_NAME:
+            return
+        for i in range(len(self.tagStack) - 1, 0, -1):
+            if not self.open_tag_counter.get(name):
+                break
+            t = self.tagStack[i]
+            self.popTag()
+            if name == t.name and nsprefix == t.prefix:
+                break
+
+    def endData(self, containerClass=None) -> None:
+        # BeautifulSoup.endData
+        if not self.current_data:
+            return
+        current_data = ''.join(self.current_data)
+        self.current_data = []
+        if not self.preserve_whitespace_tag_stack:
+            strippable = True
+            for i in current_data:
+                if i not in self.ASCII_SPACES:
+                    strippable = False
+                    break
+            if strippable:
+                if '\n' in current_data:
+                    current_data = '\n'
+                else:
+                    current_data = ' '
+
+        kind = containerClass or NavigableString
+        if self.string_container_stack and kind is NavigableString:
+            kind = self.builder.string_containers.get(self.string_container_stack[-1].name, kind)
+        string = FastString(current_data, self.currentTag, kind)
+        self.adopt(string)
+        self.emit(Tag.STRING_ELEMENT_EVENT, string)
+
+    def close(self) -> None:
+        # the same as BeautifulSoup._feed.
+        self.endData()
+        while self.currentTag is not self.root:
+            self.popTag()
+
+
+class OffsetSoup(FastSoup):
+    """
+    FastSoup which reports events as [tag_event, element, boundary]. boundary is the offset in the source right after
+    the event. A string is done where the next construct starts (the comment-like ones where they end).
+    A tag is done where its start or end tag ends, except ones closed implicitly (IMPLICIT_END_EVENT), they are done
+    where the construct which closes them starts. A stray end tag (STRAY_END_EVENT) is done where it ends.
+    """
+    def __init__(self, split_tags: frozenset[str]):
+        super().__init__(split_tags)
+        # start of the construct html.parser handles.
+        self.position = 0
+        # events done by the end of the construct, boundary is not known yet.
+        self.pending = []
+        # name of the end tag html.parser handles.
+        self.closing = None
+        self.string_ends_construct = False
+
+    def construct_end(self, offset: int) -> None:
+        for event in self.pending:
+            event[2] = offset
+        self.pending.clear()
+        self.position = offset
+
+    def emit(self, tag_event, element: FastTag|FastString) -> None:
+        event = [tag_event, element, self.position]
+        if tag_event is Tag.START_ELEMENT_EVENT:
+            self.pending.append(event)
+        elif tag_event is Tag.STRING_ELEMENT_EVENT:
+            if self.string_ends_construct:
+                self.pending.append(event)
+        elif element.name == self.closing:
+            self.pending.append(event)
+        elif tag_event is Tag.END_ELEMENT_EVENT:
+            event[0] = IMPLICIT_END_EVENT
+        self.events.append(event)
+
+    def endData(self, containerClass=None) -> None:
+        # containerClass is given for comment, doctype, cdata... which are constructs themselves.
+        self.string_ends_construct = containerClass is not None
+        super().endData(containerClass)
+
+    def _popToTag(self, name, nsprefix=None) -> None:
+        if name != self.ROOT_TAG_NAME and not self.open_tag_counter.get(name):
+            event = [STRAY_END_EVENT, None, self.position]
+            self.pending.append(event)
+            self.events.append(event)
+            return
+        self.closing = name
+        super()._popToTag(name, nsprefix)
+        self.closing = None
+
+    def close(self) -> None:
+        super().close()
+        self.construct_end(self.position)
+
+
+class OffsetParser(BeautifulSoupHTMLParser):
+    """
+    BeautifulSoupHTMLParser which tells OffsetSoup the end of every construct as the offset in the whole source.
+    html.parser calls handlers of a construct before updatepos of it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # offset of rawdata in the source, rawdata is trimmed after every feed.
+        self.base = 0
+
+    def goahead(self, end) -> None:
+        size = len(self.rawdata)
+        super().goahead(end)
+        self.base += size - len(self.rawdata)
+
+    def updatepos(self, i: int, j: int) -> int:
+        self.soup.construct_end(self.base + j)
+        return super().updatepos(i, j)
+
+
+class SliceSoup(FastSoup):
+    """
+    FastSoup which records FastTag.start, where the start tag begins, and FastTag.end, where the end tag ends.
+    end is recorded when source[start:end] is the tag as it is built: it and all its descendants are closed by
+    their own end tags. A tag closed implicitly or by '/>' of a start tag (not an empty element) leaves it and
+    its ancestors with -1. Offsets are told by OffsetParser.
+    Descendants of atomic tags are tracked on tagStack only, no contents and no strings: the tag is a slice of
+    `source`. An atomic tag left with -1 gets contents by FastSoup from its slice up to where it is closed.
+    """
+    def __init__(self, split_tags: frozenset[str], source: str = ''):
+        super().__init__(split_tags)
+        self.source = source
+        # start of the construct html.parser handles.
+        self.position = 0
+        # name of the end tag html.parser handles.
+        self.closing = None
+        # tag closed by the construct, its end is the end of the construct.
+        self.closed = None
+        # tagStack[:dirty] have a descendant closed implicitly.
+        self.dirty = 0
+
+    def construct_end(self, offset: int) -> None:
+        if self.closed is not None:
+            self.closed.end = offset
+            self.closed = None
+        self.position = offset
+
+    def emit(self, tag_event, element: FastTag|FastString) -> None:
+        # events inside atomic tags are not walked, tree_events does not give them either.
+        if self.atomic > (tag_event is Tag.START_ELEMENT_EVENT):
+            return
+        self.events.append((tag_event, element))
+
+    def adopt(self, node: FastTag|FastString) -> None:
+        pass
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs, sourceline=None, sourcepos=None, namespaces=None) -> FastTag:
+        if not self.atomic:
+            return super().handle_starttag(name, namespace, nsprefix, attrs, sourceline, sourcepos, namespaces)
+        # a descendant of atomic tag: name and offsets, attributes are not rendered.
+        self.endData()
+        tag = FastTag(name, attrs, self.currentTag, sourceline, sourcepos, self.builder.can_be_empty_element(name))
+        self.pushTag(tag)
+        return tag
+
+    def endData(self, containerClass=None) -> None:
+        if self.atomic:
+            self.current_data = []
+            return
+        super().endData(containerClass)
+
+    def pushTag(self, tag: FastTag) -> None:
+        tag.start = self.position
+        super().pushTag(tag)
+
+    def popTag(self) -> FastTag:
+        index = len(self.tagStack) - 1
+        tag = self.tagStack[index]
+        if tag.name != self.closing or (tag.start == self.position and not tag.can_be_empty_element):
+            self.dirty = index
+        elif index >= self.dirty:
+            self.closed = tag
+        if self.atomic == 1 and tag is not self.closed and tag.start < self.position:
+            tag.contents = self.contents_of(self.source[tag.start:self.position])
+        parent = super().popTag()
+        self.dirty = min(self.dirty, index)
+        return parent
+
+    def contents_of(self, html: str) -> list[FastTag|FastString]|None:
+        """
+        contents of the atomic tag of `html` as FastSoup builds it. The tag closes where `html` ends.
+        """
+        soup = FastSoup(self.split_tags)
+        args, kwargs = soup.builder.parser_args
+        parser = BeautifulSoupHTMLParser(soup, *args, **kwargs)
+        parser.feed(html)
+        parser.close()
+        soup.close()
+        # the first event is the start of the tag.
+        return soup.events[0][1].contents
+
+    def _popToTag(self, name, nsprefix=None) -> None:
+        self.closing = name
+        super()._popToTag(name, nsprefix)
+        self.closing = None
+
+
+class FastEventStream:
+    """
+    soup._event_stream() of the document which is never built. It is incremental as msg_split_stream.EventStream.
+    """
+    soup_class = FastSoup
+    parser_class = BeautifulSoupHTMLParser
+
+    def __init__(self, chunks: Iterable[str], split_tags: frozenset[str]):
+        self.chunks = iter(chunks)
+        self.soup = self.soup_class(split_tags)
+        args, kwargs = self.soup.builder.parser_args
+        self.parser = self.parser_class(self.soup, *args, **kwargs)
+
+    def getpos(self) -> tuple[int, int]:
+        return self.parser.getpos()
+
+    def __iter__(self) -> Iterator[tuple[object, FastTag|FastString]]:
+        soup = self.soup
+        events = soup.events
+        for chunk in chain(self.chunks, (None,)):
+            if chunk is None:
+                self.parser.close()
+                soup.close()
+            else:
+                self.parser.feed(chunk)
+            while events:
+                yield events.popleft()
+
+
+class OffsetEventStream(FastEventStream):
+    """
+    FastEventStream of [tag_event, element, boundary] (see OffsetSoup).
+    """
+    soup_class = OffsetSoup
+    parser_class = OffsetParser
+
+
+class SliceEventStream(FastEventStream):
+    """
+    FastEventStream of tags with offsets in the source (see SliceSoup). The source is a whole string.
+    """
+    soup_class = SliceSoup
+    parser_class = OffsetParser
+
+    def __init__(self, source: str, split_tags: frozenset[str]):
+        super().__init__((source,), split_tags)
+        self.soup.source = source
+
+
+# Light messages are split without html.parser. A message is
+# 'text' - no markup and no entities, the whole message is one string;
+# 'flat' - split tags without attributes, well nested, no entities: <b>, </b>, <p>...;
+# 'html' - anything else, it goes to html.parser.
+LIGHT_TAG = re.compile(r'<(/?)(b|i|p|ul|ol|div|span|strong)>')
+ASCII_SPACES = frozenset(BeautifulSoup.ASCII_SPACES)
+
+
+def classify(source: str) -> str:
+    if '&' in source:
+        return 'html'
+    if '<' not in source:
+        return 'text'
+    return 'flat' if light_events(source) is not None else 'html'
+
+
+def light_string(text: str, parent: FastTag) -> FastString:
+    # BeautifulSoup.endData: a string of ASCII spaces is squashed.
+    if ASCII_SPACES.issuperset(text):
+        text = '\n' if '\n' in text else ' '
+    return FastString(text, parent, NavigableString)
+
+
+def light_events(source: str) -> list[tuple[object, FastTag|FastString]]|None:
+    """
+    Events of 'text' or 'flat' message, the same as FastEventStream gives. None is for 'html' message.
+    """
+    if '&' in source:
+        return None
+    root = FastTag(BeautifulSoup.ROOT_TAG_NAME, {}, None, None, None, False)
+    if '<' not in source:
+        return [(Tag.STRING_ELEMENT_EVENT, light_string(source, root))] if source else []
+
+    tags = source.count('<')
+    events = []
+    stack = [root]
+    line = 1
+    line_start = 0
+    # newlines are counted up to here.
+    counted = 0
+    previous = 0
+    for match in LIGHT_TAG.finditer(source):
+        start = match.start()
+        # '<' of anything else in between.
+        if source.find('<', previous, start) != -1:
+            return None
+        if start > previous:
+            events.append((Tag.STRING_ELEMENT_EVENT, light_string(source[previous:start], stack[-1])))
+        closing, name = match.groups()
+        if closing:
+            # stray or crossing closing is for _popToTag.
+            if stack[-1].name != name:
+                return None
+            events.append((Tag.END_ELEMENT_EVENT, stack.pop()))
+        else:
+            # position of the tag as html.parser reports it.
+            newlines = source.count('\n', counted, start)
+            if newlines:
+                line += newlines
+                line_start = source.rindex('\n', counted, start) + 1
+            counted = start
+            tag = FastTag(name, {}, stack[-1], line, start - line_start, False)
+            events.append((Tag.START_ELEMENT_EVENT, tag))
+            stack.append(tag)
+        previous = match.end()
+        tags -= 1
+    # '<' of anything else, unclosed tags are closed by parser.
+    if tags or len(stack) > 1:
+        return None
+    if previous < len(source):
+        events.append((Tag.STRING_ELEMENT_EVENT, light_string(source[previous:], root)))
+    return events
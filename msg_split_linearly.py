@@ -10,10 +10,17 @@ from argparse import ArgumentParser
 from enum import Enum
 from itertools import chain
 from operator import attrgetter
-from typing import Iterator
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, TextIO
 
 from bs4 import BeautifulSoup
-from bs4.element import PageElement, Tag
+from bs4.element import NavigableString, PageElement, Tag
+
+from msg_split_fast import PARSERS, FastEventStream, FastString, FastTag
+from msg_split_render import LENGTHS, RenderCache
+from msg_split_stats import SplitStats, timed_pulls
+from msg_split_stream import EventStream, chunks_of, mapped_chunks, read_ahead
+from msg_split_text import TEXT_BREAK, breakable
 
 MAX_LEN = 4096
 
@@ -43,9 +50,17 @@ def dump_element(element):
     return '/'.join(map(str, reversed(parents)))
 
 
-def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
+def split_message(source: str|Iterable[str]|TextIO, max_len=MAX_LEN, parser='bs4', length: Callable[[str], int] = len, stats: SplitStats|None = None, debug=False, break_text=False) -> Iterator[str]:
     """Splits the original message (`source`) into fragments of the specified length
-    (`max_len`)."""
+    (`max_len`).
+    `source` is either a whole string or chunks of it (iterable of str, text file object). Chunks are parsed
+    as they arrive.
+    `parser` is 'bs4' (BeautifulSoup tree) or 'fast' (events of html.parser without the tree).
+    `length` measures max_len: len (code points) or additive measure of msg_split_render.LENGTHS (UTF-16 code units, UTF-8 bytes).
+    `stats` is SplitStats to fill: time of parsing, walk, joins and counts of pieces, drains...
+    `debug` runs the automata with checks of its state on every step, fragments are the same.
+    `break_text` cuts text at whitespace as msg_split.split_message does, a word longer than max_len raises
+    UnprocessedValue still."""
     # The task is mess of implementation details (BeautifulSoup, html.parser), mistakes, obscures, and gaps
     # in the description, knowledge field, corner cases. But the core idea is simple.
     # All you have to do is to calculate minimal size of characters around piece you take from html
@@ -56,24 +71,296 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
 
     if max_len <= 1:
         raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
-
-    # shortcut
-    if len(source) <= max_len:
-        yield source
-        return
-
-    try:
-        soup = BeautifulSoup(source, 'html.parser')
-    except Exception as e:
-        sourceline = None
-        sourcepos = None
-        raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+    if parser not in PARSERS:
+        raise ValueError(f'parser argument ({parser!r}) must be one of {sorted(PARSERS)}.', parser)
+
+    stream = None
+    if isinstance(source, str) and parser == 'bs4':
+        # shortcut
+        if length(source) <= max_len:
+            if stats is not None:
+                stats.fragments += 1
+            yield source
+            return
+
+        start = perf_counter()
+        try:
+            soup = BeautifulSoup(source, 'html.parser')
+        except Exception as e:
+            sourceline = None
+            sourcepos = None
+            raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+        if stats is not None:
+            stats.parse_time += perf_counter() - start
+        events = soup._event_stream()
+
+    else:
+        if isinstance(source, str):
+            source = (source,)
+        whole, chunks = read_ahead(chunks_of(source), max_len, length)
+        # shortcut
+        if whole is not None:
+            if stats is not None:
+                stats.fragments += 1
+            yield whole
+            return
+
+        # The tree is released behind pull (or never built). Space is O(max_len + depth).
+        if parser == 'fast':
+            stream = FastEventStream(chunks, split_tags)
+        else:
+            stream = EventStream(chunks, split_tags)
+        soup = stream.soup
+        events = iter(stream)
+        if stats is not None:
+            events = timed_pulls(events, stats)
+
+    if break_text:
+        events = words_of(events)
 
     eventual_encoding = 'utf-8'
     formatter = soup.formatter_for_name('minimal')
+    render = RenderCache(eventual_encoding, formatter, length=length)
+
+    if debug:
+        yield from run_automata_debug(events, stream, formatter, render, max_len, length, stats)
+    else:
+        yield from run_automata(events, stream, formatter, render, max_len, length, stats)
+
+
+# States of run_automata.
+PULL, COLLECT, DRAIN = range(3)
+# PULL resets track (0 value), COLLECT and DRAIN increment it. PULL_COLLECT_DRAIN_COLLECT_DRAIN is a cycle.
+CYCLE = 4
+
+START_ELEMENT_EVENT = Tag.START_ELEMENT_EVENT
+END_ELEMENT_EVENT = Tag.END_ELEMENT_EVENT
+EMPTY_ELEMENT_EVENT = Tag.EMPTY_ELEMENT_EVENT
+STRING_ELEMENT_EVENT = Tag.STRING_ELEMENT_EVENT
+
+
+def words_of(events: Iterator[tuple[object, PageElement]]) -> Iterator[tuple[object, PageElement]]:
+    """
+    Plain strings are cut into words with whitespace behind, see msg_split_text.TEXT_BREAK. The automata fills
+    a fragment with words, the rest of a string goes to the next one.
+    """
+    # Time complexity is O(N). Entities are made by output_ready of a word, they are never broken.
+    for tag_event, element in events:
+        if tag_event is not STRING_ELEMENT_EVENT or not breakable(element):
+            yield tag_event, element
+            continue
+        text = element.text if isinstance(element, FastString) else str(element)
+        start = 0
+        for match in TEXT_BREAK.finditer(text):
+            end = match.end()
+            if end < len(text):
+                yield tag_event, FastString(text[start:end], element.parent, NavigableString)
+                start = end
+        yield tag_event, FastString(text[start:], element.parent, NavigableString)
+
+
+def run_automata(events: Iterator[tuple[object, PageElement]], stream: EventStream|FastEventStream|None, formatter, render: RenderCache, max_len: int, length: Callable[[str], int], stats: SplitStats|None) -> Iterator[str]:
+    """
+    The automata of run_automata_debug without bookkeeping for debugging. States are integers, events are compared
+    by identity, pull falls through to collect. Chain of parent-first child is found by openings of parents.
+    """
+    sourceline = 0
+    sourcepos = 0
+    piece = ''
+    tag_event = None
+    element: PageElement|None = None
+    weight = 0
+
+    atomic_forward_index = -1
+    atomic_backward_index = -1
+    atomic_parent_index = -1
+    forward = ['']
+    forward_prefix_sum = [0]
+    backward = ['']
+    backward_prefix_sum = [0]
+    parents = [None]
+    parents_opening = ['']  # it is in sync with parents.
+    parents_prefix_sum = [0]
 
+    state = PULL
+    track = 0
+
+    if stats is not None:
+        resumed = perf_counter()
+        excluded = stats.parse_time + stats.join_time
+
+    while True:
+        if track == CYCLE:
+            raise RuntimeError(f'{sourceline}:{sourcepos}: processing is in infinitive cycle.', sourceline, sourcepos)
+
+        if state == PULL:
+            try:
+                pair = next(events, None)
+            except Exception as e:
+                if stream is None:
+                    raise
+                sourceline, sourcepos = stream.getpos()
+                raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+            if pair is None:
+                break
+            track = 0
+            state = COLLECT
+            tag_event, element = pair
+            if isinstance(element, (Tag, FastTag)):
+                if element.sourceline is not None and element.sourceline > sourceline:
+                    sourceline = element.sourceline
+                if element.sourcepos is not None and element.sourcepos > sourcepos:
+                    sourcepos = element.sourcepos
+
+        if state == COLLECT:
+            track += 1
+            fragment_len = forward_prefix_sum[-1] + backward_prefix_sum[-1]
+            if tag_event is STRING_ELEMENT_EVENT or tag_event is EMPTY_ELEMENT_EVENT:
+                if tag_event is STRING_ELEMENT_EVENT:
+                    piece = element.output_ready(formatter=formatter)
+                else:
+                    piece = element.decode(formatter=formatter)
+                weight = length(piece)
+                if fragment_len + weight > max_len:
+                    state = DRAIN
+                else:
+                    state = PULL
+                    forward.append(piece)
+                    forward_prefix_sum.append(forward_prefix_sum[-1]+weight)
+                    if stats is not None:
+                        stats.pieces += 1
+                        if atomic_forward_index != -1:
+                            stats.atomic_size += weight
+
+            elif tag_event is START_ELEMENT_EVENT:
+                rendered = render(element)
+                piece = rendered.opening
+                weight = rendered.length
+                if fragment_len + weight > max_len:
+                    state = DRAIN
+                else:
+                    state = PULL
+                    if element.name not in split_tags:
+                        if stats is not None and atomic_forward_index == -1:
+                            stats.atomic += 1
+                        atomic_forward_index = len(forward)
+                        atomic_backward_index = len(backward)
+                        atomic_parent_index = len(parents)
+                    piece_end = rendered.closing
+                    weight_end = length(piece_end)
+                    forward.append(piece)
+                    forward_prefix_sum.append(forward_prefix_sum[-1]+weight-weight_end)
+                    backward.append(piece_end)
+                    backward_prefix_sum.append(backward_prefix_sum[-1]+weight_end)
+                    parents.append(element)
+                    parents_opening.append(piece)
+                    parents_prefix_sum.append(parents_prefix_sum[-1]+weight)
+                    if stats is not None:
+                        stats.pieces += 1
+                        stats.max_depth = max(stats.max_depth, len(parents) - 1)
+                        if atomic_forward_index != -1:
+                            stats.atomic_size += weight
+
+            elif tag_event is END_ELEMENT_EVENT:
+                state = PULL
+                forward.append(backward.pop())
+                forward_prefix_sum.append(forward_prefix_sum[-1]+backward_prefix_sum.pop()-backward_prefix_sum[-1])
+                parents.pop()
+                parents_opening.pop()
+                parents_prefix_sum.pop()
+                if len(parents) <= atomic_parent_index:
+                    atomic_forward_index = -1
+                    atomic_backward_index = -1
+                    atomic_parent_index = -1
+
+            else:
+                raise RuntimeError(f'{sourceline}:{sourcepos}: unhandled tag_event {tag_event!r}', sourceline, sourcepos, tag_event)
+
+        else:
+            # size is minimal amount of characters to put element into fragment. Drain does not change it.
+            if atomic_forward_index != -1:
+                # direct parent surround, self, content.
+                size = parents_prefix_sum[atomic_parent_index] + forward_prefix_sum[-1] - forward_prefix_sum[atomic_forward_index]
+            else:
+                size = parents_prefix_sum[-1]
+            if size + weight > max_len:
+                parents_tags = [parent.name for parent in parents[1:]]
+                raise UnprocessedValue(
+                    f'{sourceline}:{sourcepos}: piece {piece[:38]!r} and html around {"/".join(parents_tags)} cannot fit max_len ({max_len}).',
+                    sourceline, sourcepos, piece, parents_tags, max_len
+                )
+
+            track += 1
+            state = COLLECT
+
+            # remove chain of parent-first child from output, like "<p><strong><i><b>", before pull atomic part.
+            # The chain is the tail of forward made of openings of the nearest parents, the very same strings.
+            if atomic_forward_index != -1:
+                forward_skip_index = atomic_forward_index
+                backward_skip_index = atomic_backward_index
+                index = atomic_parent_index - 1
+            else:
+                forward_skip_index = len(forward)
+                backward_skip_index = len(backward)
+                index = len(parents) - 1
+            while index and forward[forward_skip_index-1] is parents_opening[index]:
+                forward_skip_index -= 1
+                backward_skip_index -= 1
+                index -= 1
+
+            if stats is not None:
+                start = perf_counter()
+            fragment = ''.join(chain(forward[:forward_skip_index], reversed(backward[:backward_skip_index])))
+            if stats is not None:
+                stats.join_time += perf_counter() - start
+                stats.fragments += 1
+                stats.walk_time += perf_counter() - resumed - (stats.parse_time + stats.join_time - excluded)
+            yield fragment
+            if stats is not None:
+                resumed = perf_counter()
+                excluded = stats.parse_time + stats.join_time
+
+            descend = len(parents)
+            if atomic_forward_index != -1:
+                leading = forward[atomic_forward_index+1:]
+                initial = forward_prefix_sum[atomic_forward_index]
+                leading_prefix_sum = [s - initial for s in forward_prefix_sum[atomic_forward_index+1:]]
+                descend = atomic_parent_index+1
+
+            if stats is not None:
+                stats.drains += 1
+                stats.reopened += descend - 1
+
+            # backward stays the same.
+            del forward[1:]
+            del forward_prefix_sum[1:]
+            for index in range(1, descend):
+                forward.append(parents_opening[index])
+                forward_prefix_sum.append(parents_prefix_sum[index]-backward_prefix_sum[index])
+
+            if atomic_forward_index != -1:
+                forward.extend(leading)
+                initial = forward_prefix_sum[-1]
+                forward_prefix_sum.extend([s + initial for s in leading_prefix_sum])
+                # the atomic tag is reopened as the last parent.
+                atomic_forward_index = atomic_parent_index
+
+    if stats is not None:
+        start = perf_counter()
+    fragment = ''.join(chain(forward, backward))
+    if stats is not None:
+        stats.join_time += perf_counter() - start
+        stats.fragments += 1
+        stats.walk_time += perf_counter() - resumed - (stats.parse_time + stats.join_time - excluded)
+    yield fragment
+
+
+def run_automata_debug(events: Iterator[tuple[object, PageElement]], stream: EventStream|FastEventStream|None, formatter, render: RenderCache, max_len: int, length: Callable[[str], int], stats: SplitStats|None) -> Iterator[str]:
+    """
+    The automata of split_message as it is designed: Automata and Event enums, elements in sync with forward,
+    checks of the state on every step.
+    """
     # State is about element from a stream to push in a fragment.
-    events = soup._event_stream()
     sourceline = 0
     sourcepos = 0
     piece = ''
@@ -92,7 +379,7 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
     atomic_forward_index = -1
     atomic_backward_index = -1
     atomic_parent_index = -1
-    # _prefix_sum accumulates occupied positions from fragment with max_len.
+    # _prefix_sum accumulates occupied positions from fragment with max_len. Every piece is weighed by length once.
     forward = ['']
     forward_prefix_sum = [0]
     backward = ['']
@@ -100,6 +387,7 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
     # XXX: is it any sense of elements now?
     elements = [None]  # it is in sync with forward.
     parents = [None]
+    parents_opening = ['']  # it is in sync with parents.
     parents_prefix_sum = [0]
 
     # State is about automata.
@@ -110,18 +398,31 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
     PULL, PULL_COLLECT, PULL_COLLECT_DRAIN, PULL_COLLECT_DRAIN_COLLECT, CYCLE = range(5)
     track = PULL
 
+    # Time of the automata goes to stats in between yields. Pulls (parse) and joins are taken off.
+    if stats is not None:
+        resumed = perf_counter()
+        excluded = stats.parse_time + stats.join_time
+
     while state is not Automata.stop:
         assert len(forward) == len(forward_prefix_sum)
         assert len(forward) == len(elements), (forward, elements)
         assert len(backward) == len(backward_prefix_sum)
         assert len(parents) == len(parents_prefix_sum)
+        assert len(parents) == len(parents_opening)
 
         if track == CYCLE:
             raise RuntimeError(f'{sourceline}:{sourcepos}: processing is in infinitive cycle.', sourceline, sourcepos)
 
         match state:
             case Automata.pull:
-                pair = next(events, None)
+                try:
+                    pair = next(events, None)
+                except Exception as e:
+                    if stream is None:
+                        raise
+                    # stream parses while pulling.
+                    sourceline, sourcepos = stream.getpos()
+                    raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
                 if pair is None:
                     state = Automata.stop
 
@@ -130,12 +431,14 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                     state = Automata.collect
 
                     tag_event, element = pair
-                    if tag_event not in Event:
-                        raise RuntimeError(f'{sourceline}:{sourcepos}: unhandled tag_event {tag_event!r}', sourceline, sourcepos, tag_event)
-                    event = Event(tag_event)
+                    # `tag_event not in Event` raises TypeError before python 3.12 for bs4>=4.13 events.
+                    try:
+                        event = Event(tag_event)
+                    except ValueError:
+                        raise RuntimeError(f'{sourceline}:{sourcepos}: unhandled tag_event {tag_event!r}', sourceline, sourcepos, tag_event) from None
                     element_name = element.name
 
-                    if isinstance(element, Tag):
+                    if isinstance(element, (Tag, FastTag)):
                         if element.sourceline is not None and element.sourceline > sourceline:
                             sourceline = element.sourceline
                         if element.sourcepos is not None and element.sourcepos > sourcepos:
@@ -146,13 +449,10 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                 fragment_len = forward_prefix_sum[-1] + backward_prefix_sum[-1]
                 match event:
                     case Event.START_ELEMENT_EVENT:
-                        piece = element._format_tag(
-                            eventual_encoding, formatter, opening=True
-                        )
-                        piece_end = element._format_tag(
-                            eventual_encoding, formatter, opening=False
-                        )
-                        weight = len(piece) + len(piece_end)
+                        rendered = render(element)
+                        piece = rendered.opening
+                        piece_end = rendered.closing
+                        weight = rendered.length
 
                         if fragment_len + weight > max_len:
                             state = Automata.drain
@@ -160,17 +460,26 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                         else:
                             state = Automata.pull
                             if element.name not in split_tags:
+                                if stats is not None and atomic_forward_index == -1:
+                                    stats.atomic += 1
                                 # set length as value, because next step is append.
                                 atomic_forward_index = len(forward)
                                 atomic_backward_index = len(backward)
                                 atomic_parent_index = len(parents)
+                            weight_end = length(piece_end)
                             forward.append(piece)
-                            forward_prefix_sum.append(forward_prefix_sum[-1]+len(piece))
+                            forward_prefix_sum.append(forward_prefix_sum[-1]+weight-weight_end)
                             backward.append(piece_end)
-                            backward_prefix_sum.append(backward_prefix_sum[-1]+len(piece_end))
+                            backward_prefix_sum.append(backward_prefix_sum[-1]+weight_end)
                             elements.append(element)
                             parents.append(element)
+                            parents_opening.append(piece)
                             parents_prefix_sum.append(parents_prefix_sum[-1]+weight)
+                            if stats is not None:
+                                stats.pieces += 1
+                                stats.max_depth = max(stats.max_depth, len(parents) - 1)
+                                if atomic_forward_index != -1:
+                                    stats.atomic_size += weight
 
                     # space for closing tag is reserved up front. It does not change sum.
                     case Event.END_ELEMENT_EVENT:
@@ -179,6 +488,7 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                         forward_prefix_sum.append(forward_prefix_sum[-1]+backward_prefix_sum.pop()-backward_prefix_sum[-1])
                         elements.append(None)
                         parents.pop()
+                        parents_opening.pop()
                         parents_prefix_sum.pop()
                         if len(parents) <= atomic_parent_index:
                             atomic_forward_index = -1
@@ -186,8 +496,12 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                             atomic_parent_index = -1
 
                     case Event.EMPTY_ELEMENT_EVENT | Event.STRING_ELEMENT_EVENT:
-                        piece = element.output_ready(formatter=None)
-                        weight = len(piece)
+                        if event is Event.EMPTY_ELEMENT_EVENT:
+                            # Tag has no output_ready, it finds a child named so.
+                            piece = element.decode(formatter=formatter)
+                        else:
+                            piece = element.output_ready(formatter=formatter)
+                        weight = length(piece)
                         if fragment_len + weight > max_len:
                             state = Automata.drain
 
@@ -196,6 +510,10 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                             forward.append(piece)
                             forward_prefix_sum.append(forward_prefix_sum[-1]+weight)
                             elements.append(None)
+                            if stats is not None:
+                                stats.pieces += 1
+                                if atomic_forward_index != -1:
+                                    stats.atomic_size += weight
 
                     case unhandled:
                         raise RuntimeError(f'{sourceline}:{sourcepos}: unhandled event {unhandled!r}.', sourceline, sourcepos, unhandled)
@@ -242,9 +560,19 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                     backward_skip_index -= 1
                     parent = e.parent
 
+                if stats is not None:
+                    start = perf_counter()
                 fragment = ''.join(chain(forward[:forward_skip_index], reversed(backward[:backward_skip_index])))
-                assert len(fragment) <= max_len, ('Fragment length fits max_len', sourceline, sourcepos, fragment[:38], len(fragment), max_len)
+                fragment_len = forward_prefix_sum[forward_skip_index-1] + backward_prefix_sum[backward_skip_index-1]
+                assert fragment_len <= max_len, ('Fragment length fits max_len', sourceline, sourcepos, fragment[:38], fragment_len, max_len)
+                if stats is not None:
+                    stats.join_time += perf_counter() - start
+                    stats.fragments += 1
+                    stats.walk_time += perf_counter() - resumed - (stats.parse_time + stats.join_time - excluded)
                 yield fragment
+                if stats is not None:
+                    resumed = perf_counter()
+                    excluded = stats.parse_time + stats.join_time
 
                 descend = len(parents)
                 leading = []
@@ -257,6 +585,10 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                     leading_prefix_sum = [s - initial for s in forward_prefix_sum[atomic_forward_index+1:]]
                     descend = atomic_parent_index+1
 
+                if stats is not None:
+                    stats.drains += 1
+                    stats.reopened += descend - 1
+
                 # backward stays the same.
                 forward.clear()
                 forward.append('')
@@ -266,11 +598,7 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                 elements.extend(parents[:descend])
 
                 for index in range(1, descend):
-                    # XXX: Should it be cached in parents_opening?
-                    parent_piece = parents[index]._format_tag(
-                        eventual_encoding, formatter, opening=True
-                    )
-                    forward.append(parent_piece)
+                    forward.append(parents_opening[index])
                     forward_prefix_sum.append(parents_prefix_sum[index]-backward_prefix_sum[index])
 
                 if atomic_forward_index != -1:
@@ -278,29 +606,48 @@ def split_message(source: str, max_len=MAX_LEN) -> Iterator[str]:
                     initial = forward_prefix_sum[-1]
                     forward_prefix_sum.extend(map(lambda s: s+initial, leading_prefix_sum))
                     elements.extend(leading_elements)
+                    # the atomic tag is reopened as the last parent.
+                    atomic_forward_index = atomic_parent_index
 
                 fragment = None
 
     # do not yield empty string
     if forward or backward:
+        if stats is not None:
+            start = perf_counter()
         fragment = ''.join(chain(forward, backward))
-        assert len(fragment) <= max_len, ('Fragment length fits max_len', sourceline, sourcepos, fragment[:38], len(fragment), max_len)
+        fragment_len = forward_prefix_sum[-1] + backward_prefix_sum[-1]
+        assert fragment_len <= max_len, ('Fragment length fits max_len', sourceline, sourcepos, fragment[:38], fragment_len, max_len)
+        if stats is not None:
+            stats.join_time += perf_counter() - start
+            stats.fragments += 1
+            stats.walk_time += perf_counter() - resumed - (stats.parse_time + stats.join_time - excluded)
         yield fragment
 
 
 def main(opts):
+    length = LENGTHS[opts.length]
+    stats = SplitStats() if opts.stats else None
     with open(opts.source, 'rt') as stream:
-        source = stream.read()
-
-    for number, chunk in enumerate(split_message(source, max_len=opts.max_len), 1):
-        fragmen_length = len(chunk)
-        print(f'fragment #{number}: {fragmen_length} chars.')
-        print(chunk)
+        # mapped file is decoded by chunks, memory does not depend on size of the file.
+        if opts.mmap:
+            stream = mapped_chunks(opts.source)
+        for number, chunk in enumerate(split_message(stream, max_len=opts.max_len, length=length, stats=stats, debug=opts.debug, break_text=opts.break_text), 1):
+            fragmen_length = length(chunk)
+            print(f'fragment #{number}: {fragmen_length} {opts.length}.')
+            print(chunk)
+    if stats is not None:
+        print(stats.report())
 
 
 if __name__ == '__main__':
     arguments = ArgumentParser(description='Split html message by chunks in max-len size.')
     arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len.')
+    arguments.add_argument('--stats', action='store_true', help='Print where time goes.')
+    arguments.add_argument('--mmap', action='store_true', help='Map source file instead of reading.')
+    arguments.add_argument('--debug', action='store_true', help='Check state of the automata on every step.')
+    arguments.add_argument('--break-text', action='store_true', help='Cut long text at whitespace.')
     arguments.add_argument('source', help='Path to source file.')
 
     main(arguments.parse_args())
@@ -0,0 +1,124 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import re
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from typing import Callable, Iterator
+
+from msg_split import MAX_LEN, STRATEGIES, make_environment, parse_stream, pieces_of, split_message, split_tags
+from msg_split_compiled import CompiledMessage, compile_pieces, join_compiled, split_compiled
+from msg_split_fast import FastEventStream, FastSoup, light_events
+from msg_split_render import LENGTHS
+
+# Segments are parsed and rendered by workers, cuts and joins are made by the caller over their token tables.
+# A segment ends right after closing of a block tag, that is likely the top level of a long document.
+# The worker proves it: the parser has nothing open or pending at the end. Otherwise the segment is joined
+# with the next one.
+SEGMENT_LEN = 256 * 1024
+SEGMENT_END = re.compile(r'</(?:p|div|ul|ol)>')
+# top level blocks of long documents are on their own lines, such an end is looked for first.
+# The cut is in front of the newline: text left at the end of a segment is pending in the parser.
+LINE_END = re.compile(r'</(?:p|div|ul|ol)>(?=\n)')
+
+
+def segment_ends(source: str, segments: int) -> list[int]:
+    """Ends of about equal segments of `source`, the last one is the end of source."""
+    ends = []
+    step = len(source) // segments
+    for target in range(step, len(source), step):
+        if ends and target < ends[-1]:
+            continue
+        match = LINE_END.search(source, target, target + step // 2) or SEGMENT_END.search(source, target)
+        if match is None:
+            break
+        if match.end() < len(source):
+            ends.append(match.end())
+    ends.append(len(source))
+    return ends
+
+
+def compile_segment(segment: str, length: Callable[[str], int]) -> tuple[bytes, bool]:
+    """
+    Worker side of split_parallel. Table of the segment and whether the segment ends at the top level.
+    """
+    events = light_events(segment)
+    if events is not None:
+        # flat markup is well nested by definition.
+        pieces = pieces_of(events, make_environment(FastSoup(split_tags), MAX_LEN, length))
+        return compile_pieces(pieces, length).to_bytes(), True
+
+    top_level = []
+    stream = FastEventStream((), split_tags)
+
+    def chunks() -> Iterator[str]:
+        yield segment
+        # the segment is fed, the parser is not closed yet.
+        soup = stream.soup
+        top_level.append(len(soup.tagStack) == 1 and not stream.parser.rawdata and not soup.current_data)
+
+    stream.chunks = chunks()
+    pieces = pieces_of(parse_stream(stream), make_environment(stream.soup, MAX_LEN, length))
+    return compile_pieces(pieces, length).to_bytes(), top_level[0]
+
+
+def split_parallel(source: str, max_len=MAX_LEN, workers: int|None = None, length: Callable[[str], int] = len, strategy='greedy', segment_len=SEGMENT_LEN) -> Iterator[str]:
+    """Splits a large message (`source`) as split_message does, segments are parsed on a process pool of `workers`.
+    Fragments are the same as split_message gives. A message shorter than two segments is split by split_message.
+    `length` goes to workers, it must be one of msg_split_render.LENGTHS."""
+    # Time complexity is O(N / workers) of parsing plus O(N) of cuts and joins. Space is O(N) of token tables.
+    if max_len <= 1:
+        raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy argument ({strategy!r}) must be one of {sorted(STRATEGIES)}.', strategy)
+
+    workers = workers or cpu_count() or 1
+    # shortcut is of split_message too.
+    if workers == 1 or len(source) < 2 * segment_len or length(source) <= max_len:
+        yield from split_message(source, max_len, length=length, strategy=strategy)
+        return
+
+    # a few segments per worker, they are not equal in time.
+    ends = segment_ends(source, max(2, min(4 * workers, len(source) // segment_len)))
+    # (start, end) of segment: table, ends at the top level.
+    compiled: dict[tuple[int, int], tuple[bytes, bool]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            segments = list(zip([0] + ends[:-1], ends))
+            todo = [segment for segment in segments if segment not in compiled]
+            for segment, result in zip(todo, pool.map(compile_segment, (source[start:end] for start, end in todo), [length] * len(todo))):
+                compiled[segment] = result
+            # segment which does not end at the top level is parsed again with the next one.
+            joined = [end for start, end in segments[:-1] if compiled[start, end][1]] + ends[-1:]
+            if joined == ends:
+                break
+            ends = joined
+
+    compiled = join_compiled([CompiledMessage.from_bytes(compiled[segment][0]) for segment in segments])
+    yield from split_compiled(compiled, max_len, strategy)
+
+
+def main(opts):
+    length = LENGTHS[opts.length]
+    with open(opts.source, 'rt') as stream:
+        source = stream.read()
+    for number, chunk in enumerate(split_parallel(source, opts.max_len, opts.workers, length, opts.strategy), 1):
+        print(f'fragment #{number}: {length(chunk)} {opts.length}.')
+        print(chunk)
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Split large html message by chunks in max-len size on all cores.')
+    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len.')
+    arguments.add_argument('--strategy', choices=sorted(STRATEGIES), default='greedy')
+    arguments.add_argument('--workers', type=int, default=None, help='Processes, all CPUs by default.')
+    arguments.add_argument('source', help='Path to source file.')
+
+    main(arguments.parse_args())
@@ -0,0 +1,327 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+from argparse import ArgumentParser
+from bisect import bisect_right
+from collections import deque
+from itertools import chain
+from typing import Callable, Iterator, TextIO
+
+from bs4.element import Tag
+
+from msg_split import MAX_LEN, UnprocessedValue, split_tags
+from msg_split_fast import IMPLICIT_END_EVENT, STRAY_END_EVENT, FastTag, OffsetEventStream, classify
+from msg_split_render import LENGTHS, Rendered, RenderCache
+
+# IncrementalSplit compares drafts by this much.
+COMPARE_BLOCK = 16 * 1024
+
+# plan_split does not serialize the document. Body of a fragment is a span of the source as is, only reopened
+# ancestors (prefix) and closings of open ones (suffix) are rendered. The body keeps entities, quotes and spaces
+# of the source, so text of fragments differs from split_message output, the structure is the same.
+# Where the source is not balanced the span is patched: closings are rendered for tags closed implicitly (by the end
+# tag of an ancestor or by the end of the source) and stray end tags are dropped.
+# Weight is of the body as it is written: an entity of the source weighs as it is written, not as the character
+# split_message renders. So entity-heavy text takes more fragments and plan_split may raise UnprocessedValue
+# for a piece which split_message fits.
+
+
+class Fragment:
+    """
+    Fragment is prefix + source[start:end] + suffix, length is its weight by the measure of plan_split.
+    patches are (start, end, text) of the span to write instead of source[start:end], sorted, mostly none.
+    """
+    __slots__ = ('prefix', 'start', 'end', 'suffix', 'length', 'patches')
+
+    def __init__(self, prefix: str, start: int, end: int, suffix: str, length: int, patches: tuple[tuple[int, int, str], ...] = ()):
+        self.prefix = prefix
+        self.start = start
+        self.end = end
+        self.suffix = suffix
+        self.length = length
+        self.patches = patches
+
+    @property
+    def span(self) -> tuple[int, int]:
+        return self.start, self.end
+
+    def body(self, source: str) -> Iterator[str]:
+        offset = self.start
+        for start, end, text in self.patches:
+            yield source[offset:start]
+            yield text
+            offset = end
+        yield source[offset:self.end]
+
+    def text(self, source: str) -> str:
+        return ''.join(chain((self.prefix,), self.body(source), (self.suffix,)))
+
+    def write(self, source: str, stream: TextIO) -> None:
+        stream.write(self.prefix)
+        for piece in self.body(source):
+            stream.write(piece)
+        stream.write(self.suffix)
+
+    def __repr__(self):
+        return f'Fragment({self.prefix!r}, {self.start}, {self.end}, {self.suffix!r}, {self.length}, {self.patches!r})'
+
+
+def parse_offsets(events: OffsetEventStream, size: int) -> Iterator[tuple[object, FastTag|None, int]]:
+    # Ignored constructs (stray end tags) after the last event belong to the last fragment. The end is a boundary too.
+    try:
+        yield from events
+    except Exception as e:
+        sourceline, sourcepos = events.getpos()
+        raise UnprocessedValue(f'{sourceline}:{sourcepos}: source cannot be parsed.', sourceline, sourcepos) from e
+    yield None, None, size
+
+
+def plan_split(source: str, max_len=MAX_LEN, length: Callable[[str], int] = len) -> Iterator[Fragment]:
+    """Plans fragments of the original message (`source`) no longer than `max_len` by `length` measure.
+    Fragment is a span of `source` with reopened ancestors and closings around. Text is not built, see
+    Fragment.text and Fragment.write. Tags of `source` which are not closed by their own end tags are closed
+    in the fragment, stray end tags are dropped."""
+    if max_len <= 1:
+        raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+
+    # shortcut, 'text' and 'flat' messages are balanced.
+    weight = length(source)
+    if weight <= max_len and classify(source) != 'html':
+        yield Fragment('', 0, len(source), '', weight)
+        return
+
+    for fragment, _ in plan_from(source, max_len, length):
+        yield fragment
+
+
+def plan_from(source: str, max_len: int, length: Callable[[str], int] = len, start=0, prefix='') -> Iterator[tuple[Fragment, int]]:
+    """
+    plan_split from `start` of `source` with open ancestors `prefix`: start and prefix of a planned fragment resume
+    the plan there. Every fragment goes with the end of `source` which was parsed to plan it, a fragment planned
+    by the end of `source` goes with len(source).
+    """
+    # Time complexity is O(N), events after the last cut candidate are replayed once per fragment.
+    # Space is O(depth + events of max_len).
+    # the parser gets ancestors as a source, their events open parents and are not a part of the fragment.
+    stream = OffsetEventStream((prefix, source[start:]) if prefix else (source[start:],), split_tags)
+    render = RenderCache('utf-8', stream.soup.formatter_for_name(None), length=length)
+
+    # open split tags, prefix sums of weight of openings and closings are in sync.
+    parents: list[Rendered] = []
+    openings_sum = [0]
+    closings_sum = [0]
+
+    def push(rendered: Rendered) -> None:
+        closing = length(rendered.closing)
+        parents.append(rendered)
+        openings_sum.append(openings_sum[-1] + rendered.length - closing)
+        closings_sum.append(closings_sum[-1] + closing)
+
+    def pop() -> Rendered:
+        openings_sum.pop()
+        closings_sum.pop()
+        return parents.pop()
+
+    # State is about fragment.
+    prefix_weight = 0
+    body = 0  # weight of source[start:boundary]
+    # The last cut candidate: boundary not in atomic tag and not right after opening tag.
+    cut = start
+    cut_body = 0
+    # events after the cut candidate with their weights and patches, they are replayed by the next fragment.
+    held: list[tuple[object, FastTag|None, int, int, tuple[int, int, str]|None]] = []
+    # patches of source[start:cut].
+    patches: list[tuple[int, int, str]] = []
+    # how to return parents to the cut candidate: None is pop, Rendered is push.
+    undo: list[Rendered|None] = []
+    atomic = 0
+
+    replay = deque()
+    shift = start - len(prefix)
+    events = parse_offsets(stream, len(source) - shift)
+    previous = start
+    priming = bool(prefix)
+    while True:
+        if replay:
+            tag_event, element, boundary, weight, patch = replay.popleft()
+        else:
+            pair = next(events, None)
+            if pair is None:
+                break
+            tag_event, element, boundary = pair
+            boundary += shift
+            if priming:
+                if boundary <= start:
+                    assert tag_event is Tag.START_ELEMENT_EVENT, f'{prefix!r} is not openings of split tags.'
+                    push(render(element))
+                    prefix_weight = openings_sum[-1]
+                    continue
+                priming = False
+            # every piece of the source is weighed once, as it is written.
+            patch = None
+            if tag_event is STRAY_END_EVENT:
+                patch = (previous, boundary, '')
+                weight = 0
+            else:
+                weight = boundary - previous if length is len else length(source[previous:boundary])
+                if tag_event is IMPLICIT_END_EVENT:
+                    closing = parents[-1].closing if not atomic else render(element).closing
+                    patch = (boundary, boundary, closing)
+                    weight += length(closing)
+            previous = boundary
+
+        held.append((tag_event, element, boundary, weight, patch))
+        body += weight
+        opened = False
+        if tag_event is Tag.START_ELEMENT_EVENT:
+            if atomic or element.name not in split_tags:
+                atomic += 1
+            else:
+                push(render(element))
+                undo.append(None)
+                opened = True
+        elif tag_event is Tag.END_ELEMENT_EVENT or tag_event is IMPLICIT_END_EVENT:
+            if atomic:
+                atomic -= 1
+            else:
+                undo.append(pop())
+
+        if prefix_weight + body + closings_sum[-1] > max_len:
+            if cut == start:
+                # html.parser position of the piece: line from 1, column from 0.
+                sourceline = source.count('\n', 0, start) + 1
+                sourcepos = start - source.rfind('\n', 0, start) - 1
+                piece = source[start:boundary]
+                raise UnprocessedValue(
+                    f'{sourceline}:{sourcepos}: piece {piece[:38]!r} and html around cannot fit max_len ({max_len}).',
+                    sourceline, sourcepos, piece, max_len
+                )
+
+            # back to the cut candidate.
+            for rendered in reversed(undo):
+                if rendered is None:
+                    pop()
+                else:
+                    push(rendered)
+            undo.clear()
+            atomic = 0
+            suffix = ''.join(rendered.closing for rendered in reversed(parents))
+            # an end closed by the end of the source is not there, the source may go on.
+            parsed = len(source) if tag_event is IMPLICIT_END_EVENT else boundary
+            yield Fragment(prefix, start, cut, suffix, prefix_weight + cut_body + closings_sum[-1], tuple(patches)), parsed
+
+            start = cut
+            prefix = ''.join(rendered.opening for rendered in parents)
+            prefix_weight = openings_sum[-1]
+            body = 0
+            cut_body = 0
+            patches.clear()
+            replay.extendleft(reversed(held))
+            held.clear()
+
+        elif not atomic and not opened and boundary > start:
+            cut = boundary
+            cut_body = body
+            patches.extend(held_patch for *_, held_patch in held if held_patch is not None)
+            held.clear()
+            undo.clear()
+
+    # the end is the last cut candidate, everything is closed.
+    if cut > start:
+        yield Fragment(prefix, start, cut, '', prefix_weight + cut_body, tuple(patches)), len(source)
+
+
+def common_prefix(previous: str, source: str) -> int:
+    # slices of COMPARE_BLOCK, not of the whole draft: copies stay in cache.
+    size = min(len(previous), len(source))
+    for block in range(0, size, COMPARE_BLOCK):
+        if previous[block:block + COMPARE_BLOCK] != source[block:block + COMPARE_BLOCK]:
+            for index in range(block, min(block + COMPARE_BLOCK, size)):
+                if previous[index] != source[index]:
+                    return index
+    return size
+
+
+class IncrementalSplit:
+    """
+    plan_split of a draft which is edited. update() keeps fragments which were planned before the first changed
+    character and plans the rest from the start of the first changed one: an append costs a fragment or two,
+    whatever the size of the draft. Checkpoints are the planned fragments themselves (start and prefix).
+    Fragments are of plan_split: a tag the draft does not close yet is closed by the last one.
+    """
+    def __init__(self, max_len=MAX_LEN, length: Callable[[str], int] = len):
+        if max_len <= 1:
+            raise ValueError(f'max_len argument ({max_len!r}) must be more then 0.', max_len)
+        self.max_len = max_len
+        self.length = length
+        self.source = ''
+        self.fragments: list[Fragment] = []
+        # end of the source parsed to plan a fragment, the fragment is the same while the source is the same up to it.
+        self.parsed: list[int] = []
+        self.reused = 0  # by the last update
+
+    def update(self, source: str, changed: int|None = None) -> list[Fragment]:
+        """
+        Plan of the new version of the draft. `changed` is the first changed character, if the editor knows it,
+        otherwise the draft is compared with the previous one.
+        """
+        if changed is None:
+            changed = common_prefix(self.source, source)
+        elif changed < 0:
+            raise ValueError(f'changed argument ({changed!r}) must be 0 or more.', changed)
+        # characters past the end of either draft are changed anyway.
+        changed = min(changed, len(self.source), len(source))
+        # The parser decides on a construct by the next character, so a fragment is kept if the source is the same
+        # one character past its parsed end. The last one is planned up to EOF, it is never kept.
+        kept = bisect_right(self.parsed, changed - 1)
+        if kept:
+            resume = self.fragments[kept]
+            planned = plan_from(source, self.max_len, self.length, resume.start, resume.prefix)
+        else:
+            weight = self.length(source)
+            # shortcut
+            if weight <= self.max_len and classify(source) != 'html':
+                planned = [(Fragment('', 0, len(source), '', weight), len(source))]
+            else:
+                planned = plan_from(source, self.max_len, self.length)
+
+        fragments = self.fragments[:kept]
+        parsed = self.parsed[:kept]
+        for fragment, end in planned:
+            fragments.append(fragment)
+            parsed.append(end)
+        # nothing is changed if source cannot be split.
+        self.source = source
+        self.fragments = fragments
+        self.parsed = parsed
+        self.reused = kept
+        return fragments
+
+    def texts(self) -> Iterator[str]:
+        for fragment in self.fragments:
+            yield fragment.text(self.source)
+
+
+def main(opts):
+    length = LENGTHS[opts.length]
+    with open(opts.source, 'rt') as stream:
+        source = stream.read()
+    for number, fragment in enumerate(plan_split(source, max_len=opts.max_len, length=length), 1):
+        print(f'fragment #{number}: {fragment.length} {opts.length}, source {fragment.start}:{fragment.end}.')
+        if not opts.plan:
+            print(fragment.text(source))
+
+
+if __name__ == '__main__':
+    arguments = ArgumentParser(description='Plan split of html message by chunks in max-len size.')
+    arguments.add_argument('--max-len', type=int, default=MAX_LEN)
+    arguments.add_argument('--length', choices=list(LENGTHS), default='chars', help='Unit of max-len.')
+    arguments.add_argument('--plan', action='store_true', help='Print spans only.')
+    arguments.add_argument('source', help='Path to source file.')
+
+    main(arguments.parse_args())
@@ -0,0 +1,82 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable
+
+# the command line shortcut measures length without html parsers.
+if TYPE_CHECKING:
+    from bs4.element import Tag
+
+# Distinct tag shapes kept per document. Stream of unique attributes must not grow memory.
+CACHE_SIZE = 1024
+
+
+# Measures of length. A measure must be additive: weight of concatenation is sum of weights.
+# Engines weigh every piece once and sum weights, fragments are not measured again.
+def utf16_length(text: str) -> int:
+    """Amount of UTF-16 code units, as javascript length."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def utf8_length(text: str) -> int:
+    """Amount of UTF-8 bytes."""
+    return len(text.encode('utf-8'))
+
+
+LENGTHS: dict[str, Callable[[str], int]] = {
+    'chars': len,
+    'utf-16': utf16_length,
+    'utf-8': utf8_length,
+}
+
+
+@dataclass(slots=True, frozen=True)
+class Rendered:
+    opening: str
+    closing: str
+    length: int  # length(opening) + length(closing)
+
+
+class RenderCache:
+    """
+    Per document cache of Tag._format_tag. Tags with the same name and attributes render the same,
+    so the key is the shape of a tag, not the tag. `<li>` x 1000 is formatted once.
+    """
+    def __init__(self, eventual_encoding: str, formatter, size=CACHE_SIZE, length: Callable[[str], int] = len):
+        self.eventual_encoding = eventual_encoding
+        self.formatter = formatter
+        self.size = size
+        self.length = length
+        self.entries: dict[tuple, Rendered] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, tag: Tag) -> Rendered:
+        # everything _format_tag looks at.
+        key = (
+            tag.name, tag.prefix, tag.hidden, tag.is_empty_element,
+            tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in tag.attrs.items())
+        )
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        opening = tag._format_tag(self.eventual_encoding, self.formatter, opening=True)
+        closing = ''
+        if not tag.is_empty_element:
+            closing = tag._format_tag(self.eventual_encoding, self.formatter, opening=False)
+        entry = Rendered(opening, closing, self.length(opening) + self.length(closing))
+        if len(self.entries) >= self.size:
+            self.entries.clear()
+        self.entries[key] = entry
+        return entry
@@ -0,0 +1,83 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import json
+import os
+import socket
+import stat
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from typing import Callable, Iterator
+
+from msg_split_errors import UnprocessedValue
+from msg_split_render import LENGTHS
+
+# The client does not import html parsers, it is the whole point: a shell pipeline pays a socket round trip
+# per message instead of imports. Html parsers are warm in the server.
+# Request is JSON line of keyword arguments of split_message {"max_len", "length", "strategy", "engine", "atomic",
+# "break_text", "verbatim"} and the message in UTF-8 up to the end of the stream. "length" is a name of LENGTHS.
+# Response is JSON line per fragment {"fragment"}, a failure is the last line {"error", "args"}.
+
+
+# Errors of the server raised by the client again, anything else is RuntimeError.
+ERRORS = {
+    'UnprocessedValue': UnprocessedValue,
+    'ValueError': ValueError,
+}
+
+
+class SplitHandler(StreamRequestHandler):
+    def handle(self):
+        try:
+            options = json.loads(self.rfile.readline())
+            options['length'] = LENGTHS[options['length']]
+            source = self.rfile.read().decode('utf-8')
+            for fragment in self.server.split(source, **options):
+                self.wfile.write(json.dumps({'fragment': fragment}, ensure_ascii=False).encode('utf-8') + b'\n')
+        except Exception as e:
+            record = {'error': type(e).__name__, 'args': e.args}
+            self.wfile.write(json.dumps(record, ensure_ascii=False, default=repr).encode('utf-8') + b'\n')
+
+
+def serve(path: str, split: Callable[..., Iterator[str]]):
+    """Splits messages of clients of Unix socket `path` by `split` (split_message) until KeyboardInterrupt.
+    A connection is a message, connections are served by threads."""
+    # socket of the previous run is left on kill.
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+    with ThreadingUnixStreamServer(path, SplitHandler) as server:
+        server.daemon_threads = True
+        server.split = split
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+def split_remote(path: str, source: str, max_len: int, length='chars', strategy='greedy', engine='iterative', atomic=False, break_text=False, verbatim=False) -> Iterator[str]:
+    """Fragments of `source` split by the server of Unix socket `path`. `length` is a name of
+    msg_split_render.LENGTHS, other arguments are of split_message. Fragments come as the server makes them."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        options = {
+            'max_len': max_len, 'length': length, 'strategy': strategy, 'engine': engine, 'atomic': atomic,
+            'break_text': break_text, 'verbatim': verbatim,
+        }
+        connection.sendall(json.dumps(options).encode('utf-8') + b'\n' + source.encode('utf-8'))
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('rb') as response:
+            for line in response:
+                record = json.loads(line)
+                if 'fragment' in record:
+                    yield record['fragment']
+                    continue
+                error = ERRORS.get(record['error'])
+                if error is None:
+                    raise RuntimeError(record['error'], *record['args'])
+                raise error(*record['args'])
@@ -0,0 +1,72 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+from dataclasses import dataclass, fields
+from time import perf_counter
+from typing import Iterable, Iterator
+
+
+@dataclass(slots=True)
+class SplitStats:
+    """
+    Where split_message spends time. Engines fill it when it is given by stats=, otherwise nothing is counted.
+    Time is in seconds. Time of a consumer in between fragments is not counted.
+    """
+    parse_time: float = 0.0  # html parsing, tree building
+    walk_time: float = 0.0  # the engine without parsing and joins
+    join_time: float = 0.0  # fragments are built from pieces
+    fragments: int = 0
+    pieces: int = 0  # placed in fragments: openings, strings, atomic nodes...
+    drains: int = 0
+    reopened: int = 0  # ancestor tags reopened by drains
+    atomic: int = 0  # subtrees not in split_tags
+    atomic_size: int = 0  # their rendered length
+    max_depth: int = 0  # of open tags the engine keeps track of
+    engine: str = ''  # choice of engine 'auto'
+
+    def report(self) -> str:
+        return '\n'.join(
+            f'{field.name}: {value:.6f}' if isinstance(value, float) else f'{field.name}: {value}'
+            for field in fields(self)
+            for value in (getattr(self, field.name),)
+        )
+
+
+def timed_pulls(events: Iterable, stats: SplitStats) -> Iterator:
+    """
+    Stream parses while pulling, time of pulls is parse time.
+    """
+    events = iter(events)
+    while True:
+        start = perf_counter()
+        pair = next(events, None)
+        stats.parse_time += perf_counter() - start
+        if pair is None:
+            return
+        yield pair
+
+
+def timed_fragments(fragments: Iterable[str], stats: SplitStats) -> Iterator[str]:
+    """
+    Time of the engine in between fragments. Parse and join time counted meanwhile are taken off.
+    """
+    fragments = iter(fragments)
+    parse_time = stats.parse_time
+    join_time = stats.join_time
+    active = 0.0
+    try:
+        while True:
+            start = perf_counter()
+            fragment = next(fragments, None)
+            active += perf_counter() - start
+            if fragment is None:
+                return
+            stats.fragments += 1
+            yield fragment
+    finally:
+        stats.walk_time += active - (stats.parse_time - parse_time) - (stats.join_time - join_time)
@@ -0,0 +1,154 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import mmap
+from codecs import getincrementaldecoder
+from collections import deque
+from functools import partial
+from itertools import chain
+from typing import Callable, Iterable, Iterator, TextIO
+
+from bs4 import BeautifulSoup
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from bs4.element import PageElement, Tag
+
+# Size of read() calls for file objects.
+STREAM_CHUNK = 64 * 1024
+
+
+def chunks_of(source: Iterable[str] | TextIO) -> Iterator[str]:
+    """
+    Iterating a text file gives lines. A dump in one line is not a chunk, so file objects are read by STREAM_CHUNK.
+    """
+    if hasattr(source, 'read'):
+        return iter(partial(source.read, STREAM_CHUNK), '')
+    return iter(source)
+
+
+def mapped_chunks(path: str, encoding='utf-8', chunk=STREAM_CHUNK) -> Iterator[str]:
+    """
+    Text of file `path` by chunks of `chunk` bytes. The file is memory mapped, pages are the page cache of OS,
+    not memory of the process. Only the chunk in hand is decoded.
+    """
+    decoder = getincrementaldecoder(encoding)()
+    with open(path, 'rb') as stream:
+        # empty file cannot be mapped.
+        if not stream.seek(0, 2):
+            return
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            for start in range(0, len(mapped), chunk):
+                text = decoder.decode(mapped[start:start + chunk])
+                if text:
+                    yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def read_ahead(chunks: Iterator[str], max_len: int, length: Callable[[str], int] = len) -> tuple[str | None, Iterator[str]]:
+    """
+    Stream version of `length(source) <= max_len` shortcut. Head is read until it is longer than max_len.
+    Returns whole source if it fits, otherwise None and all chunks again.
+    """
+    head = []
+    consumed = 0
+    for chunk in chunks:
+        head.append(chunk)
+        consumed += length(chunk)
+        if consumed > max_len:
+            return None, chain(head, chunks)
+    return ''.join(head), iter(())
+
+
+class StreamSoup(BeautifulSoup):
+    """
+    BeautifulSoup records construction of the tree as pairs of Tag._event_stream().
+    Tag is started on push, string is done on object_was_parsed, tag is done on pop.
+    """
+    def reset(self) -> None:
+        self.events = deque()
+        super().reset()
+        self.events.clear()
+
+    def pushTag(self, tag: Tag) -> None:
+        super().pushTag(tag)
+        # Empty element is known only on pop. html.parser closes it immediately anyway.
+        if not tag.can_be_empty_element:
+            self.events.append((Tag.START_ELEMENT_EVENT, tag))
+
+    def popTag(self) -> Tag | None:
+        if self.tagStack:
+            tag = self.tagStack[-1]
+            if tag is not self:
+                if tag.is_empty_element:
+                    self.events.append((Tag.EMPTY_ELEMENT_EVENT, tag))
+                else:
+                    assert not tag.can_be_empty_element, f'{tag.name} is started as empty element and has content.'
+                    self.events.append((Tag.END_ELEMENT_EVENT, tag))
+        return super().popTag()
+
+    def object_was_parsed(self, o: PageElement, parent: Tag | None = None, most_recent_element: PageElement | None = None) -> None:
+        super().object_was_parsed(o, parent, most_recent_element)
+        self.events.append((Tag.STRING_ELEMENT_EVENT, o))
+
+
+class EventStream:
+    """
+    Incremental replacement of soup._event_stream(). html.parser is fed chunk by chunk and pairs are handed out
+    as soon as they are known.
+
+    The tree does not keep the past. Element is released (extracted from the tree) on the next pull after it is done.
+    Descendants of atomic tag (not in split_tags) are kept until the atomic tag is done, because engines render it as a whole.
+    So the tree is open-tag stack plus the current atomic subtree.
+    """
+    def __init__(self, chunks: Iterable[str], split_tags: frozenset[str]):
+        self.chunks = iter(chunks)
+        self.split_tags = split_tags
+        self.soup = StreamSoup('', 'html.parser')
+        args, kwargs = self.soup.builder.parser_args
+        self.parser = BeautifulSoupHTMLParser(self.soup, *args, **kwargs)
+
+    def getpos(self) -> tuple[int, int]:
+        return self.parser.getpos()
+
+    def __iter__(self) -> Iterator[tuple[object, PageElement]]:
+        soup = self.soup
+        events = soup.events
+        atomic = 0
+        done = None
+
+        for chunk in chain(self.chunks, (None,)):
+            if chunk is None:
+                self.parser.close()
+                # the same as BeautifulSoup._feed.
+                soup.endData()
+                while soup.currentTag is not None and soup.currentTag.name != soup.ROOT_TAG_NAME:
+                    soup.popTag()
+            else:
+                self.parser.feed(chunk)
+
+            while events:
+                pair = events.popleft()
+                if done is not None:
+                    # earlier siblings are released already.
+                    done.extract(_self_index=0)
+                    done = None
+
+                tag_event, element = pair
+                if tag_event is Tag.START_ELEMENT_EVENT:
+                    if element.name not in self.split_tags:
+                        atomic += 1
+                elif tag_event is Tag.END_ELEMENT_EVENT and element.name not in self.split_tags:
+                    atomic -= 1
+
+                yield pair
+
+                if not atomic and tag_event is not Tag.START_ELEMENT_EVENT:
+                    done = element
@@ -0,0 +1,47 @@
+"""
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Author Stepan Bakshaev, 2024.
+Contact stepan.bakshaev@keemail.me
+"""
+import re
+from typing import Callable
+
+from bs4.element import NavigableString, PageElement
+
+from msg_split_fast import FastString
+
+# Text breaks of break_text, split_message and msg_split_linearly cut strings the same way.
+# Break opportunity of a string is right after a run of whitespace, sentence ends are followed by it too.
+# Whitespace of html only: no-break space (U+00A0, &nbsp; is not escaped back) and other unicode spaces glue.
+# Entities of output_ready have no whitespace, they are never broken.
+TEXT_BREAK = re.compile(r'[ \t\n\r\f]+')
+
+
+def breakable(source_node: PageElement) -> bool:
+    """
+    Plain text. Comments, doctype, CDATA have prefix and suffix, they are not cut.
+    """
+    if isinstance(source_node, FastString):
+        return source_node.kind is NavigableString
+    return type(source_node) is NavigableString
+
+
+def text_breaks(text: str, length: Callable[[str], int]) -> tuple[list[int], list[int]]:
+    """
+    Break index of rendered string: offsets of breaks, 0 and the end included, and weights of text in front of them.
+    """
+    # Time complexity is O(N), every character is measured once.
+    breaks = [0]
+    weights = [0]
+    for match in TEXT_BREAK.finditer(text):
+        end = match.end()
+        if end < len(text):
+            weights.append(weights[-1] + length(text[breaks[-1]:end]))
+            breaks.append(end)
+    if breaks[-1] < len(text):
+        weights.append(weights[-1] + length(text[breaks[-1]:]))
+        breaks.append(len(text))
+    return breaks, weights
@@ -6,10 +6,39 @@ You should have received a copy of the GNU General Public License along with thi
 Author Stepan Bakshaev, 2024.
 Contact stepan.bakshaev@keemail.me
 """
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
 import pytest
 from bs4 import BeautifulSoup
 
-from msg_split import UnprocessedValue, split_message, split_tags
+import msg_split_bench
+import msg_split_linearly
+from msg_split_async import asplit_message
+from msg_split_auto import RECURSION_DEPTH, choose_engine, profile_of
+from msg_split_batch import read_sources, split_sources
+from msg_split_bench import generate, least_squares, nonnegative_least_squares, paragraphs_block
+from msg_split_cache import SplitCache
+from msg_split_compiled import CompiledMessage, compile_message, split_compiled
+from msg_split_fast import classify
+from msg_split_parallel import compile_segment, segment_ends, split_parallel
+from msg_split_plan import IncrementalSplit, plan_split
+from msg_split_render import LENGTHS, RenderCache
+from msg_split_serve import serve, split_remote
+from msg_split_stats import SplitStats
+from msg_split_stream import mapped_chunks
+from msg_split import (
+    UnprocessedValue, check_splittable, min_feasible_max_len, split_message, split_message_multi, split_messages, split_tags
+)
 
 # XXX: html.parser squashes spaces in some cases to new line. Do not use spaces in original message for indentation.
 
@@ -180,3 +209,689 @@ def test_nested():
         '<p>Hello!</p>',
         '<p><b><i><strong>World</strong></i></b>!</p>'
     ]
+
+
+@pytest.mark.parametrize('engine', [split_message, msg_split_linearly.split_message])
+@pytest.mark.parametrize('size', [1, 7, 64])
+def test_stream_chunks(engine, size):
+    message = '<div>' + '<p>Hello, <a href="https://example.com/?a=1&amp;b=2">World</a>!<br><b><i>&lt;3</i></b></p>\n' * 20 + '</div>'
+    chunks = (message[i:i+size] for i in range(0, len(message), size))
+    assert list(engine(chunks, 120)) == list(engine(message, 120))
+
+
+def test_stream_file():
+    message = '<p>Hello!<b><i><strong>World</strong></i></b>!</p>' * 10
+    assert list(split_message(StringIO(message), 44)) == list(split_message(message, 44))
+
+
+def test_stream_shortcut():
+    message = '<a><b /></a>'
+    assert list(split_message(iter(message), len(message))) == [message]
+
+
+def test_split_messages():
+    fragment = '<p>Hello, World!</p>'
+    messages = [fragment, '<b></b>' * 3, fragment * 3, '<b><i><strong></strong></i></b>' + fragment] * 3
+    results = list(split_messages(messages, len(fragment), workers=2, batch_len=len(fragment)))
+    assert len(results) == len(messages)
+    assert results[0::4] == [[fragment]] * 3
+    assert results[1::4] == [['<b></b><b></b>', '<b></b>']] * 3
+    assert results[2::4] == [[fragment] * 3] * 3
+    assert all(isinstance(error, UnprocessedValue) for error in results[3::4])
+
+
+def test_render_cache():
+    soup = BeautifulSoup('<ul><li>1</li><li>2</li><li class="a b">3</li></ul>', 'html.parser')
+    render = RenderCache('utf-8', soup.formatter_for_name(None))
+    rendered = [render(tag) for tag in soup.find_all('li')]
+    assert [r.opening + r.closing for r in rendered] == ['<li></li>', '<li></li>', '<li class="a b"></li>']
+    assert rendered[0] is rendered[1]
+    assert (render.hits, render.misses) == (1, 2)
+
+
+@pytest.mark.parametrize('message, max_len', [
+    ('<p>Hello!<b><i><strong>World</strong></i></b>!</p>' * 3, 44),
+    ('<div><p>a<a href="#">b<b>c</b></a><br>d</p>\n<ul><li>e</li></ul><span>f</span></div>' * 3, 50),
+])
+def test_iterative_as_recursive(message, max_len):
+    assert list(split_message(message, max_len)) == list(split_message(message, max_len, engine='recursive'))
+
+
+def test_iterative_deep():
+    depth = 5000
+    message = '<b>' * depth + ''.join(f'<i>{i}</i>' for i in range(100)) + '</b>' * depth
+    max_len = len('<b></b>') * depth + 100
+    fragments = list(split_message(message, max_len))
+    assert len(fragments) > 1
+    assert all(len(fragment) <= max_len for fragment in fragments)
+    assert fragments[-1].endswith('<i>99</i>' + '</b>' * depth)
+
+
+# Shared corpus of bs4 and fast parsers. html.parser and bs4 tree construction corner cases.
+PARSER_CORPUS = [
+    '<!DOCTYPE html><html><head><meta charset="latin1"><meta http-equiv="Content-Type" content="text/html; charset=latin1">'
+    '<style>p > b { color: red }</style><script>if (a < b && c) {}</script></head><body>',
+    '<p class="  a   b ">x &amp; y &lt; z &gt; &quot; &#39; &#x41; &#65 &nbsp; &unknown; &copy</p>',
+    '<!-- comment --><p>a<br>b<br/>c</br><img src="a.png" alt=\'q"q\'></p><![CDATA[x<y]]><?php echo 1 ?>',
+    '<div><p>unclosed<p>second</div></span>stray<b>bold<i>both</b>after</i>',
+    '<pre>  keep   \n  spaces </pre>   \n   <textarea>  t  </textarea><p/><b/>',
+    '<a href="x" href="y" data-x="1 &amp; 2">dup</a><td headers="a b">c</td><a rel="nofollow  noopener">r</a>',
+    '<ul>\n<li>one</li>\n<li>two<ul><li>three</li></ul></li>\n</ul>\t \n<template><p>t</p></template>',
+    'text & more < less > "quote" <b>b</b> &#0; &#128512; &#150; <P CLASS=Up>Upper</P><input disabled value="">',
+]
+
+
+@pytest.mark.parametrize('engine', [split_message, msg_split_linearly.split_message])
+@pytest.mark.parametrize('message', PARSER_CORPUS)
+def test_parser_fast(engine, message):
+    for max_len in (len(message) - 1, 60, 30):
+        try:
+            expected = list(engine(message, max_len))
+        except (UnprocessedValue, msg_split_linearly.UnprocessedValue) as e:
+            with pytest.raises(type(e)):
+                list(engine(message, max_len, parser='fast'))
+        else:
+            assert list(engine(message, max_len, parser='fast')) == expected
+
+
+@pytest.mark.parametrize('parser', ('bs4', 'fast'))
+@pytest.mark.parametrize('message', PARSER_CORPUS)
+def test_linear_debug(parser, message):
+    for max_len in (len(message) - 1, 60, 30, 10):
+        stats = [SplitStats(), SplitStats()]
+        results = []
+        for debug, stat in zip((False, True), stats):
+            try:
+                results.append(list(msg_split_linearly.split_message(message, max_len, parser=parser, stats=stat, debug=debug)))
+            except msg_split_linearly.UnprocessedValue as e:
+                results.append(e.args)
+        assert results[0] == results[1]
+        assert stats[0].pieces == stats[1].pieces and stats[0].drains == stats[1].drains
+
+
+@pytest.mark.parametrize('parser', ('bs4', 'fast'))
+def test_linear_escapes_text(parser):
+    # strings are rendered by the formatter of tags, &lt; does not become a tag.
+    message = '<p>a &lt;b&gt; &amp; c</p>' * 5
+    for debug in (False, True):
+        fragments = list(msg_split_linearly.split_message(message, 40, parser=parser, debug=debug))
+        assert len(fragments) > 1 and all('&lt;b&gt; &amp;' in fragment and '<b>' not in fragment for fragment in fragments)
+
+
+def test_engine_auto():
+    assert [round(x, 6) for x in least_squares([(1, 0), (1, 1), (1, 2)], [1, 3, 5])] == [1, 2]
+    assert [round(x, 6) for x in nonnegative_least_squares([(1, 0), (1, 1), (1, 2)], [5, 3, 1])] == [3, 0]
+    profile = profile_of('<div><p>a<code>x<b>y</b></code></p><br></div>' * 3, split_tags)
+    assert profile.depth == 4 and profile.tags == 27 and profile.atomic == len('<code>x<b>y</b></code>') * 3
+    assert choose_engine('<p>text</p>' * 10, split_tags).reason == 'light scan'
+    # costs cross: recursive is cheaper per tag, iterative per character.
+    costs = {('iterative', 'bs4'): (0.0, 0.001, 0.02, 0.0), ('recursive', 'bs4'): (0.0, 0.002, 0.01, 0.0)}
+    tags = choose_engine('<br>' + '<span>&amp;</span>' * 1000, split_tags, costs, costs)
+    text = choose_engine('<br>' + '&amp; text ' * 10000, split_tags, costs, costs)
+    assert (tags.engine, text.engine) == ('recursive', 'iterative')
+    assert tags.profile.tags > text.profile.tags
+    # too deep for recursion.
+    deep = '<div>' * RECURSION_DEPTH + '&amp;' + '</div>' * RECURSION_DEPTH
+    assert choose_engine(deep, split_tags, costs, costs).engine == 'iterative'
+    # the cheapest by every feature is chosen without a profile.
+    costs[('iterative', 'fast')] = (0.0, 0.0005, 0.005, 0.0)
+    choice = choose_engine(deep, split_tags, costs, costs)
+    assert (choice.engine, choice.parser, choice.profile) == ('iterative', 'fast', None)
+    # calibrated costs: the choice for bs4 depends on the message, the parser of the caller is kept.
+    engines = {}
+    for shape in ('flat', 'atomic', 'entities', 'tags'):
+        message = '<br>' + generate(shape, 20000)
+        choice = choose_engine(message, split_tags, [('iterative', 'bs4'), ('recursive', 'bs4')])
+        engines[shape] = choice.engine
+        stats = SplitStats()
+        assert list(split_message(message, 1024, engine='auto', stats=stats)) == list(split_message(message, 1024))
+        assert stats.engine == choice.report()
+        assert list(split_message(message, 1024, engine='auto', strategy='balanced')) == list(split_message(message, 1024, strategy='balanced'))
+        stats = SplitStats()
+        assert list(split_message(message, 1024, engine='auto', parser='fast', stats=stats)) == list(split_message(message, 1024))
+        assert stats.engine.startswith('iterative/fast')
+    assert (engines['flat'], engines['tags']) == ('iterative', 'recursive')
+
+
+def test_bench():
+    for shape in msg_split_bench.SHAPES:
+        assert len(msg_split_bench.generate(shape, 2048)) >= 2048
+    results = list(msg_split_bench.run(msg_split_bench.SHAPES, [2048], [1024], msg_split_bench.ENGINES, memory=False))
+    assert len(results) == len(msg_split_bench.SHAPES) * len(msg_split_bench.ENGINES)
+    assert all(result.error is None and result.fragments for result in results)
+
+
+@pytest.mark.parametrize('engine', [split_message, msg_split_linearly.split_message])
+@pytest.mark.parametrize('length', list(LENGTHS))
+def test_length(engine, length):
+    length = LENGTHS[length]
+    message = '<div>' + ''.join(f'<p>😀 {i} é</p><b>漢字</b>' for i in range(50)) + '</div>'
+    max_len = 64
+    fragments = list(engine(message, max_len, length=length))
+    assert all(length(fragment) <= max_len for fragment in fragments)
+    assert ''.join(fragments).count('😀') == 50
+    assert list(engine(StringIO(message), max_len, length=length)) == fragments
+
+
+@pytest.mark.parametrize('max_len', [60, 100, 333])
+def test_plan_split(max_len):
+    # canonical html: the source as is and serialization are the same.
+    message = '<div>' + ''.join(f'<p>para {i} <b>bold</b> <a href="/{i}">link</a></p>\n' for i in range(40)) + '</div><ul><li>x</li></ul>'
+    plan = list(plan_split(message, max_len))
+    assert [fragment.text(message) for fragment in plan] == list(split_message(message, max_len))
+    assert plan[0].start == 0 and plan[-1].end == len(message)
+    assert all(previous.end == fragment.start for previous, fragment in zip(plan, plan[1:]))
+    assert all(fragment.length == len(fragment.text(message)) for fragment in plan)
+
+
+def test_plan_split_source():
+    # entities and quotes stay as is, stray end tags are dropped.
+    message = "<p class='a'>&amp; &lt;x&gt;</p><P>upper<br/></P></span><b>" + 'bold ' * 5 + '</b>'
+    plan = list(plan_split(message, 40))
+    assert len(plan) > 1
+    assert ''.join(message[fragment.start:fragment.end] for fragment in plan) == message
+    assert '</span>' not in ''.join(fragment.text(message) for fragment in plan)
+    stream = StringIO()
+    plan[1].write(message, stream)
+    assert stream.getvalue() == plan[1].text(message)
+    with pytest.raises(UnprocessedValue):
+        list(plan_split('<a>' + 'x' * 50 + '</a>', 40))
+
+
+@pytest.mark.parametrize('message', [
+    '<div><p>' + 'text ' * 8 + '<b>bold</div><p>' + 'tail ' * 8,
+    '<p>' + 'x ' * 10 + '<code><b>y</code> ' + 'z ' * 10 + '</p></b>',
+    '<div><p>' + '<b>unfinished para</b> ' * 3 + '<b>unfinished para',
+])
+def test_plan_split_malformed(message):
+    # tags closed implicitly are closed in fragments, the same as split_message does.
+    plan = list(plan_split(message, 60))
+    assert [fragment.text(message) for fragment in plan] == list(split_message(message, 60))
+    assert all(fragment.length == len(fragment.text(message)) for fragment in plan)
+    with pytest.raises(UnprocessedValue) as error:
+        list(plan_split('<p>\n  text <a>' + 'x' * 60 + '</a></p>', 40))
+    assert error.value.args[1:3] == (2, 7)
+
+
+def test_split_cache():
+    cache = SplitCache(entries=2)
+    messages = ['<p>' + f'<b>{i}</b> ' * 20 + '</p>' for i in range(3)]
+    expected = list(split_message(messages[0], 30))
+    assert list(cache(messages[0], 30)) == expected
+    assert list(cache(messages[0], 30)) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    # other max_len or options are other entries.
+    assert list(cache(messages[0], 30, engine='recursive')) == expected
+    list(cache(messages[1], 30))
+    assert (len(cache), cache.evictions) == (2, 1)
+    # chunks are not kept.
+    assert list(cache(iter(messages[2]), 30)) == list(split_message(messages[2], 30))
+    assert cache.stats() == {'entries': 2, 'bytes': cache.bytes, 'hits': 1, 'misses': 3, 'evictions': 1}
+
+    cache = SplitCache(size=cache.bytes // 2)
+    list(cache(messages[0], 30))
+    list(cache(messages[1], 30))
+    assert len(cache) == 1 and cache.evictions == 1
+    with pytest.raises(UnprocessedValue):
+        cache('<a>' + 'x' * 50 + '</a>', 30)
+    assert len(cache) == 1
+
+    # stats is not a part of the key: a miss is split with it, a hit counts fragments only.
+    cache = SplitCache()
+    missed = SplitStats()
+    assert list(cache(messages[0], 30, stats=missed)) == expected
+    assert missed.fragments == len(expected) and missed.pieces > 0
+    hit = SplitStats()
+    assert list(cache(messages[0], 30, stats=hit)) == expected
+    assert list(cache(messages[0], 30)) == expected
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert hit.fragments == len(expected) and hit.pieces == 0 and hit.parse_time == 0
+
+
+def test_strategy():
+    message = '<div>' + ''.join(f'<p>{i} ' + '<b>bold</b> ' * (i % 4 + 1) + '</p>' for i in range(20)) + '</div>'
+    max_len = 200
+    greedy = list(split_message(message, max_len))
+    minimal = list(split_message(message, max_len, strategy='minimal'))
+    balanced = list(split_message(message, max_len, strategy='balanced'))
+    assert len(greedy) == len(minimal) == len(balanced)
+    # every fragment starts with a paragraph, not with the reopened one.
+    assert all(fragment.startswith('<div><p>') and fragment[8].isdigit() for fragment in minimal)
+    assert max(map(len, balanced)) <= max(map(len, greedy))
+    assert min(map(len, balanced)) > min(map(len, greedy))
+    assert all(len(fragment) <= max_len for fragment in minimal + balanced)
+    assert list(split_message(StringIO(message), max_len, parser='fast', strategy='balanced')) == balanced
+
+    with pytest.raises(UnprocessedValue):
+        list(split_message('<p>' + '<a>link</a>' * 3 + 'x' * 50 + '</p>', 40, strategy='minimal'))
+    # stray end tags are no pieces at all, every strategy gives one empty fragment as greedy does.
+    for strategy in ('minimal', 'balanced'):
+        for parser in ('bs4', 'fast'):
+            assert list(split_message('</i>' * 20, 10, parser=parser, strategy=strategy)) == ['']
+    with pytest.raises(ValueError):
+        list(split_message(message, max_len, engine='recursive', strategy='minimal'))
+
+
+@pytest.mark.parametrize('split', (
+    split_message,
+    lambda source, max_len, **options: split_message(source, max_len, engine='recursive', **options),
+    lambda source, max_len, **options: split_message(StringIO(source), max_len, parser='fast', **options),
+    msg_split_linearly.split_message,
+))
+def test_stats(split):
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code></p>' for i in range(20)) + '</div>'
+    stats = SplitStats()
+    fragments = list(split(message, 120, stats=stats))
+    assert fragments == list(split(message, 120))
+    assert stats.fragments == len(fragments) > 1
+    assert stats.drains == len(fragments) - 1
+    assert stats.reopened >= stats.drains
+    assert stats.atomic == 20 and stats.atomic_size == sum(len(f'<code>code {i}</code>') for i in range(20))
+    assert stats.pieces > stats.atomic and stats.max_depth >= 1
+    assert min(stats.parse_time, stats.walk_time, stats.join_time) >= 0
+
+
+def test_split_sources(tmp_path):
+    fragment = '<p>Hello, World!</p>'
+    messages = tmp_path / 'messages'
+    messages.mkdir()
+    (messages / 'a.html').write_text(fragment * 3)
+    (messages / 'b.html').write_text(fragment)
+    (messages / 'c.html').write_text('<p>' + 'x' * 40 + '</p>')
+    stdin = StringIO(json.dumps({'id': 'd', 'source': fragment * 2}) + '\n')
+    output = StringIO()
+    errors = StringIO()
+    sources = read_sources([str(messages), '-'], stdin)
+    summary = split_sources(sources, output, errors, len(fragment), workers=2, text=True, batch_len=1)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [(record['id'][-6:], record['fragment']) for record in records[:4]] == [
+        ('a.html', 0), ('a.html', 1), ('a.html', 2), ('b.html', 0)]
+    assert records[4:] == [{'id': 'd', 'fragment': number, 'length': len(fragment), 'text': fragment} for number in (0, 1)]
+    error, = map(json.loads, errors.getvalue().splitlines())
+    assert error['id'].endswith('c.html') and 'cannot fit max_len' in error['error']
+    assert (summary.messages, summary.fragments, summary.errors) == (4, 6, 1)
+
+    # inputs which are not messages are errors too, the run goes on.
+    stdin = StringIO('{"id": "e"\n' + json.dumps({'id': 'f'}) + '\n[]\n' + json.dumps({'id': 'g', 'source': fragment}) + '\n')
+    output = StringIO()
+    errors = StringIO()
+    sources = read_sources(['-', str(tmp_path / 'missing'), str(messages / 'b.html')], stdin)
+    summary = split_sources(sources, output, errors, len(fragment), workers=1)
+    ids = [json.loads(line)['id'] for line in output.getvalue().splitlines()]
+    assert ids[0] == 'g' and ids[1].endswith('b.html')
+    records = [json.loads(line) for line in errors.getvalue().splitlines()]
+    assert [(record['id'], record['line']) for record in records[:3]] == [(1, 1), (2, 2), (3, 3)]
+    assert records[3]['id'].endswith('missing') and 'no such file' in records[3]['error']
+    assert (summary.messages, summary.fragments, summary.errors) == (6, 2, 4)
+
+    # a file which is not UTF-8 is an error of its own.
+    (messages / 'e.html').write_bytes('<p>café</p>'.encode('latin-1'))
+    output = StringIO()
+    errors = StringIO()
+    summary = split_sources(read_sources([str(messages), str(messages / '*.html')]), output, errors, len(fragment), workers=1)
+    records = [json.loads(line) for line in errors.getvalue().splitlines()]
+    assert sorted(record['id'][-6:] for record in records) == ['c.html', 'c.html', 'e.html', 'e.html']
+    assert all('not UTF-8' in record['error'] for record in records if record['id'].endswith('e.html'))
+    assert (summary.messages, summary.errors) == (8, 4)
+
+
+def test_mapped_chunks(tmp_path):
+    path = tmp_path / 'message.html'
+    message = '<p>déjà vu 😀</p>' * 10
+    path.write_text(message, encoding='utf-8')
+    # chunks cut multibyte characters.
+    assert ''.join(mapped_chunks(str(path), chunk=3)) == message
+    assert list(split_message(mapped_chunks(str(path), chunk=5), 60)) == list(split_message(message, 60))
+    path.write_text('')
+    assert list(mapped_chunks(str(path))) == []
+
+
+# 100 MB run takes minutes, it is on by MSG_SPLIT_HUGE=1.
+HUGE_SIZES = [256 * 1024, 1024 * 1024] + ([100 * 1024 * 1024] if os.environ.get('MSG_SPLIT_HUGE') else [])
+
+
+@pytest.mark.parametrize('parser', ('bs4', 'fast'))
+@pytest.mark.parametrize('size', HUGE_SIZES)
+def test_mapped_memory(tmp_path, size, parser):
+    path = tmp_path / 'huge.html'
+    rng = random.Random(0)
+    with open(path, 'wt') as stream:
+        written = 0
+        while written < size:
+            written += stream.write(paragraphs_block(rng))
+
+    tracemalloc.start()
+    try:
+        fragments = 0
+        for fragment in split_message(mapped_chunks(str(path)), parser=parser):
+            assert len(fragment) <= 4096
+            fragments += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert fragments >= size // 4096
+    # the tree is released behind the walk, peak does not depend on size. BeautifulSoup and its builder cost more.
+    assert peak < {'bs4': 4, 'fast': 2}[parser] * 1024 * 1024
+
+
+def test_incremental_split():
+    draft = '<div>' + ''.join(f'<p>{i} <b>bold</b> text</p>' for i in range(100))
+    split = IncrementalSplit(200)
+    assert repr(split.update(draft)) == repr(list(plan_split(draft, 200))) and split.reused == 0
+    fragments = len(split.fragments)
+    for text in ('<p>appended', ' text</p>', '</div>'):
+        draft += text
+        assert repr(split.update(draft)) == repr(list(plan_split(draft, 200)))
+        assert split.reused >= fragments - 2
+    draft = draft[:100] + 'edit' + draft[100:]
+    assert repr(split.update(draft, 100)) == repr(list(plan_split(draft, 200)))
+    assert split.reused <= 1
+    assert list(split.texts()) == [fragment.text(draft) for fragment in plan_split(draft, 200)]
+    # the changed character past the end of either draft.
+    assert repr(split.update(draft + '<p>open', len(draft) * 2)) == repr(list(plan_split(draft + '<p>open', 200)))
+    assert list(split.texts())[-1].endswith('<p>open</p>')
+    assert repr(split.update(draft[:-300], len(draft))) == repr(list(plan_split(draft[:-300], 200)))
+    with pytest.raises(ValueError):
+        split.update(draft, -1)
+    split = IncrementalSplit(200)
+    split.update('<p>short')
+    assert list(split.texts()) == ['<p>short</p>']
+
+
+@pytest.mark.parametrize('parser', ('bs4', 'fast'))
+@pytest.mark.parametrize('strategy', ('greedy', 'balanced'))
+def test_split_message_multi(parser, strategy):
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code></p>' for i in range(20)) + '</div>'
+    limits = [30, 120, 400, len(message)]
+    results = split_message_multi(message, limits + [120], parser=parser, strategy=strategy)
+    assert list(results) == limits
+    assert isinstance(results[30], UnprocessedValue)
+    for max_len in limits[1:]:
+        assert results[max_len] == list(split_message(message, max_len, parser=parser, strategy=strategy))
+    assert results[len(message)] == [message]
+
+
+@pytest.mark.parametrize('parser', ('bs4', 'fast'))
+def test_min_feasible_max_len(parser):
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code> é😀</p>' for i in range(20)) + '</div>'
+    for length in LENGTHS.values():
+        required = min_feasible_max_len(message, parser, length)
+        check_splittable(message, required, parser, length)
+        for strategy in ('greedy', 'minimal', 'balanced'):
+            assert list(split_message(message, required, parser=parser, length=length, strategy=strategy))
+            with pytest.raises(UnprocessedValue) as error:
+                list(split_message(message, required - 1, parser=parser, length=length, strategy=strategy))
+        assert error.value.args[-1] == required
+        with pytest.raises(UnprocessedValue):
+            check_splittable(message, required - 1, parser, length)
+    assert min_feasible_max_len('<p>short</p>', parser) == len('<p>short</p>')
+
+
+def test_split_message_atomic():
+    message = ''.join(f'<p>paragraph {i}</p>' for i in range(10)) + '<p><code>' + 'x' * 50 + '</code></p>'
+    fragments = split_message(message, 40, atomic=True)
+    # nothing is yielded before the failure.
+    with pytest.raises(UnprocessedValue) as error:
+        next(fragments)
+    assert error.value.args[-1] == len('<p><code>' + 'x' * 50 + '</code></p>')
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code></p>' for i in range(20)) + '</div>'
+    for max_len in (60, 120, 400):
+        assert list(split_message(message, max_len, atomic=True)) == list(split_message(message, max_len))
+        assert list(split_message(StringIO(message), max_len, atomic=True)) == list(split_message(message, max_len))
+    with pytest.raises(ValueError):
+        list(split_message(message, 60, engine='recursive', atomic=True))
+
+
+@pytest.mark.parametrize('parser', ('bs4', 'fast'))
+def test_split_message_break_text(parser):
+    text = 'Lorem ipsum &amp; dolor sit amet. ' * 40
+    message = f'<div><p>{text}</p><!-- comment is not cut --><p><b>{text}</b></p></div>'
+    with pytest.raises(UnprocessedValue):
+        list(split_message(message, 200, parser=parser))
+    fragments = list(split_message(message, 200, parser=parser, break_text=True))
+    assert all(len(fragment) <= 200 for fragment in fragments)
+    # text is cut at whitespace only, entities are whole.
+    soup = BeautifulSoup(message, 'html.parser')
+    assert ''.join(BeautifulSoup(fragment, 'html.parser').get_text() for fragment in fragments) == soup.get_text()
+    assert all(fragment.endswith(' </p></div>') or fragment.endswith(' </b></p></div>') for fragment in fragments[:-1] if '<!--' not in fragment)
+    assert list(split_message(message, 200, parser=parser, break_text=True, atomic=True)) == fragments
+    if parser == 'bs4':
+        assert list(split_message(message, 200, engine='recursive', break_text=True)) == fragments
+    assert list(split_message(StringIO(message), 200, parser=parser, break_text=True)) == fragments
+    # msg_split_linearly escapes text, &amp; stays as is.
+    linear = list(msg_split_linearly.split_message(message, 200, parser=parser, break_text=True))
+    assert list(msg_split_linearly.split_message(message, 200, parser=parser, debug=True, break_text=True)) == linear
+    assert all(len(fragment) <= 200 for fragment in linear) and len(linear) > 1
+    assert ''.join(BeautifulSoup(fragment, 'html.parser').get_text() for fragment in linear) == soup.get_text()
+    assert min_feasible_max_len(message, parser, break_text=True) == len('<div><!-- comment is not cut --></div>')
+    with pytest.raises(UnprocessedValue):
+        list(split_message('<p>' + 'x' * 300 + '</p>', 200, parser=parser, break_text=True))
+    with pytest.raises(msg_split_linearly.UnprocessedValue):
+        list(msg_split_linearly.split_message('<p>' + 'x' * 300 + '</p>', 200, parser=parser, break_text=True))
+    # no-break space is not a break.
+    glued = '<p>' + '10&nbsp;km ' * 40 + '</p>'
+    fragments = list(split_message(glued, 53, parser=parser, break_text=True))
+    assert len(fragments) > 1
+    assert all(fragment[len('<p>'):-len('</p>')].strip(' ').split(' ') == ['10\xa0km'] * fragment.count('km') for fragment in fragments)
+
+
+def test_split_message_verbatim():
+    table = "<table class='t'><tr><td>1 &amp; 2</td></tr><tr><td>3<br>4</td></tr></table>"
+    message = ''.join(f'<p>paragraph {i}</p>{table}' for i in range(5))
+    fragments = list(split_message(message, 100, verbatim=True))
+    assert fragments == [f'<p>paragraph {i}</p>{table}' for i in range(5)]
+    assert list(split_message(StringIO(message), 100, verbatim=True, strategy='minimal')) == fragments
+    # decode quotes attributes and unescapes text.
+    assert list(split_message(message, 100, parser='fast')) != fragments
+    # <b> is closed implicitly, the source of code is not the tree.
+    assert list(split_message('<p>x</p><code><b>y</code>', 21, verbatim=True)) == ['<p>x</p>', '<code><b>y</b></code>']
+    # contents of atomic tags are not built, one closed implicitly is parsed again from its slice.
+    for malformed in ('<table><tr><td>1<td>2 &amp; 3</table>', '<div><code>y<i>z</div>', '<code/>', '<code>a<b>b</code>c'):
+        malformed = '<p>' + 'x' * 60 + '</p>' + malformed
+        assert list(split_message(malformed, 70, verbatim=True)) == list(split_message(malformed, 70, parser='fast'))
+    with pytest.raises(ValueError):
+        list(split_message(message, 100, engine='recursive', verbatim=True))
+
+
+@pytest.mark.parametrize('options', (
+    {}, {'slice_len': 0}, {'slice_events': 1}, {'slice_len': 0, 'queue_len': 1}, {'strategy': 'balanced'},
+))
+def test_asplit_message(options):
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code></p>' for i in range(20)) + '</div>'
+    strategy = options.get('strategy', 'greedy')
+
+    async def fragments(source, max_len):
+        return [fragment async for fragment in asplit_message(source, max_len, **options)]
+
+    async def first(source, max_len):
+        splits = asplit_message(source, max_len, **options)
+        async for fragment in splits:
+            await splits.aclose()
+            return fragment
+
+    for max_len in (60, 120, 400, len(message)):
+        expected = list(split_message(message, max_len, strategy=strategy))
+        assert asyncio.run(fragments(message, max_len)) == expected
+        assert asyncio.run(first(message, max_len)) == expected[0]
+    with pytest.raises(UnprocessedValue):
+        asyncio.run(fragments(message, 30))
+
+
+def test_asplit_message_break():
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code></p>' for i in range(200)) + '</div>'
+    measured = []
+
+    def length(text):
+        measured.append(text)
+        return len(text)
+
+    fragments = split_message(message, 60, length=length)
+    expected = next(fragments)
+    fragments.close()
+    # the walk is slow in the second fragment, the consumer leaves meanwhile.
+    first = len(measured)
+    measured.clear()
+    walking = threading.Event()
+
+    def slow(text):
+        if len(measured) == first:
+            walking.set()
+            time.sleep(0.2)
+        return length(text)
+
+    async def broken():
+        async for fragment in asplit_message(message, 60, length=slow, executor=executor, slice_len=0, queue_len=1):
+            await asyncio.to_thread(walking.wait)
+            break
+        return fragment
+
+    # break leaves the generator to asyncio.run, the walk ends before the loop is closed.
+    with ThreadPoolExecutor(1) as executor:
+        assert asyncio.run(broken()) == expected
+        walked = len(measured)
+        executor.submit(int).result()
+        assert len(measured) == walked
+
+
+def test_asplit_message_chunks():
+    # a long string is parsed by chunks: fragments come out while it is parsed, leaving stops the parse.
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code></p>' for i in range(5000)) + '</div>'
+
+    async def timed():
+        start = time.perf_counter()
+        first = None
+        async for _ in asplit_message(message, 4096):
+            if first is None:
+                first = time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    async def left():
+        splits = asplit_message(message, 4096)
+        async for _ in splits:
+            break
+        start = time.perf_counter()
+        await splits.aclose()
+        return time.perf_counter() - start
+
+    first, total = asyncio.run(timed())
+    assert first < total / 4
+    assert asyncio.run(left()) < total / 4
+
+
+def test_cli_without_parsers(tmp_path):
+    # the command line and its client start without html parsers.
+    code = 'import sys, msg_split_cli, msg_split_errors, msg_split_const; assert "bs4" not in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    # msg_split.py is the same command line, a message which fits is printed before html parsers are imported.
+    source = tmp_path / 'message.html'
+    source.write_text('<p>Hello, World!</p>')
+    code = (
+        'import sys, runpy\n'
+        'try:\n    runpy.run_path("msg_split.py", run_name="__main__")\n'
+        'finally:\n    assert "bs4" not in sys.modules'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code, str(source)], check=False, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0 and result.stdout.splitlines()[-1] == '<p>Hello, World!</p>', result.stderr
+
+
+def test_split_remote(tmp_path):
+    path = str(tmp_path / 'split.sock')
+    server = threading.Thread(target=serve, args=(path, split_message), daemon=True)
+    server.start()
+    while not os.path.exists(path):
+        server.join(0.01)
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code> é😀</p>' for i in range(20)) + '</div>'
+    for max_len, strategy in ((60, 'greedy'), (120, 'balanced'), (len(message), 'greedy')):
+        expected = list(split_message(message, max_len, length=LENGTHS['utf-16'], strategy=strategy))
+        assert list(split_remote(path, message, max_len, 'utf-16', strategy)) == expected
+    with pytest.raises(UnprocessedValue):
+        list(split_remote(path, message, 30))
+    # every option of split_message reaches the server.
+    text = '<p>' + ' '.join(f'word{i}' for i in range(40)) + '</p>'
+    assert list(split_remote(path, text, 50, break_text=True)) == list(split_message(text, 50, break_text=True))
+    for options in ({'engine': 'recursive'}, {'atomic': True}, {'verbatim': True}):
+        assert list(split_remote(path, message, 60, **options)) == list(split_message(message, 60, **options))
+    with pytest.raises(ValueError):
+        list(split_remote(path, message, 60, engine='recursive', verbatim=True))
+    with pytest.raises(ValueError):
+        list(split_remote(path, message, 1))
+
+
+@pytest.mark.parametrize('strategy', ('greedy', 'minimal', 'balanced'))
+def test_compiled_message(tmp_path, strategy):
+    message = '<div>' + ''.join(f'<p>{i} <b>bold</b> <code>code {i}</code> é😀</p>' for i in range(20)) + '</div>'
+    compiled = compile_message(message, LENGTHS['utf-16'])
+    compiled.save(tmp_path / 'message.table')
+    loaded = CompiledMessage.load(tmp_path / 'message.table')
+    assert loaded.measure == 'utf-16' and max(loaded.depths) == 3
+    for max_len in (60, 120, 400):
+        expected = list(split_message(message, max_len, length=LENGTHS['utf-16'], strategy=strategy))
+        assert list(split_compiled(compiled, max_len, strategy)) == expected
+        assert list(split_compiled(loaded, max_len, strategy)) == expected
+    with pytest.raises(UnprocessedValue):
+        list(split_compiled(loaded, 30, strategy))
+
+
+LIGHT_TAGS = ('b', 'i', 'p', 'div', 'span', 'strong', 'ul', 'ol')
+LIGHT_TEXTS = ('word', ' ', '\n', '  ', 'é😀 ', '\t', '\r\n', 'x' * 15, ' a > b ', 'lorem ipsum dolor')
+# html is mixed in: the scan must give up on it.
+LIGHT_NOISE = ('<br>', '&amp;', '<', '<B>', '<a>x</a>', '<b class="x">', '</p >', '</b>', '<code>', '</p></i>')
+
+
+def light_message(rng, depth=0) -> str:
+    parts = []
+    for _ in range(rng.randrange(5)):
+        if depth < 4 and rng.random() < 0.4:
+            tag = rng.choice(LIGHT_TAGS)
+            parts.append(f'<{tag}>{light_message(rng, depth + 1)}</{tag}>')
+        else:
+            parts.append(rng.choice(LIGHT_TEXTS))
+    if not depth and rng.random() < 0.1:
+        parts.insert(rng.randrange(len(parts) + 1), rng.choice(LIGHT_NOISE))
+    return ''.join(parts)
+
+
+def split_or_error(fragments):
+    try:
+        return list(fragments)
+    except UnprocessedValue as e:
+        return e.args
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_light_messages(seed):
+    # property: text and flat messages split without html.parser as they split by it (stream always parses).
+    rng = random.Random(seed)
+    classes = set()
+    for _ in range(250):
+        message = light_message(rng)
+        classes.add(classify(message))
+        for max_len in (20, 40, 80):
+            for strategy in ('greedy', 'balanced'):
+                expected = split_or_error(split_message(StringIO(message), max_len, strategy=strategy))
+                assert split_or_error(split_message(message, max_len, strategy=strategy)) == expected, message
+    assert classes == {'text', 'flat', 'html'}
+
+
+@pytest.mark.parametrize('strategy', ('greedy', 'minimal'))
+def test_split_parallel(strategy):
+    # segments ending in a comment, inside an open div or in the middle of text are joined with the next ones.
+    message = ''.join((
+        generate('paragraphs', 3000), '<!-- </p> -->', generate('atomic', 3000), '<div><p>open</p>',
+        generate('nested', 3000), '</div>tail &amp; text', generate('entities', 3000, seed=1), generate('paragraphs', 3000, seed=2),
+    ))
+    for max_len in (1024, 4096):
+        expected = list(split_message(message, max_len, strategy=strategy))
+        assert list(split_parallel(message, max_len, workers=2, strategy=strategy, segment_len=1000)) == expected
+
+
+def test_segments_top_level():
+    # a document of top level lines stays split, no segment is parsed again with the next one.
+    message = ''.join(f'<p class="c">line {i} &amp; text</p>\n' for i in range(2000))
+    ends = segment_ends(message, 4)
+    assert len(ends) == 4
+    assert all(compile_segment(message[start:end], len)[1] for start, end in zip([0] + ends[:-2], ends[:-1]))
+    assert list(split_parallel(message, 4096, workers=2, segment_len=1000)) == list(split_message(message, 4096))